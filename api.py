@@ -11,13 +11,13 @@ Endpoints:
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from functools import cache
 import os
+import time
+import asyncio
+import httpx
 
-from rag import query as rag_query, check_ollama_connection
-from vectorstore import get_stats, add_documents
-from processor import extract_pdf_with_metadata
-from scraper import download_pdf
-from config import DOCUMENTS_DIR, LLM_MODEL
+from config import DOCUMENTS_DIR, LLM_MODEL, OLLAMA_BASE_URL
 
 app = FastAPI(
     title="BNM Policy Chatbot API",
@@ -35,6 +35,61 @@ app.add_middleware(
 )
 
 
+# Heavy modules (torch, chromadb, PyMuPDF, Playwright) are imported on first
+# use so the server starts fast and /api/health stays lightweight
+@cache
+def _rag():
+    import rag
+    return rag
+
+
+@cache
+def _vectorstore():
+    import vectorstore
+    return vectorstore
+
+
+@cache
+def _query_engine():
+    """Coalesces concurrent /api/query requests into batched retrieval"""
+    return _rag().BatchedQueryEngine()
+
+
+async def _ollama_ready() -> bool:
+    """Lightweight check that Ollama is up and has the configured model"""
+    try:
+        async with httpx.AsyncClient(timeout=1) as client:
+            response = await client.get(f"{OLLAMA_BASE_URL}/api/tags")
+            response.raise_for_status()
+            models = [m.get('name', '') for m in response.json().get('models', [])]
+    except (httpx.HTTPError, ValueError):
+        return False
+    
+    model_base = LLM_MODEL.split(':')[0]
+    return any(m.startswith(model_base) for m in models)
+
+
+# Cached result of the last Ollama probe, shared by all requests
+OLLAMA_PROBE_TTL = 5.0
+_health_cache = {"ok": False, "ts": float("-inf")}
+_probe_lock = asyncio.Lock()
+
+
+async def _probe_ollama(ttl: float = OLLAMA_PROBE_TTL) -> bool:
+    """Ollama readiness, probed at most once per `ttl` seconds"""
+    if time.monotonic() - _health_cache["ts"] < ttl:
+        return _health_cache["ok"]
+    
+    async with _probe_lock:
+        # Another request may have refreshed it while we waited
+        if time.monotonic() - _health_cache["ts"] < ttl:
+            return _health_cache["ok"]
+        
+        ok = await _ollama_ready()
+        _health_cache.update(ok=ok, ts=time.monotonic())
+        return ok
+
+
 # Request/Response models
 class QueryRequest(BaseModel):
     question: str
@@ -73,14 +128,17 @@ async def root():
 
 @app.get("/api/health")
 async def health():
-    return {"status": "healthy", "ollama": check_ollama_connection()}
+    return {"status": "healthy", "ollama": await _ollama_ready()}
 
 
 @app.get("/api/stats", response_model=StatsResponse)
 async def stats():
-    db_stats = get_stats()
+    db_stats, ollama_connected = await asyncio.gather(
+        asyncio.to_thread(_vectorstore().get_stats),
+        _probe_ollama()
+    )
     return StatsResponse(
-        ollama_connected=check_ollama_connection(),
+        ollama_connected=ollama_connected,
         model=LLM_MODEL,
         total_chunks=db_stats['total_chunks'],
         collection_name=db_stats['collection_name']
@@ -89,13 +147,13 @@ async def stats():
 
 @app.post("/api/query", response_model=QueryResponse)
 async def query(request: QueryRequest):
-    if not check_ollama_connection():
+    if not await _probe_ollama():
         raise HTTPException(
             status_code=503,
             detail="Ollama is not running. Start with: ollama serve"
         )
     
-    result = rag_query(request.question, n_results=request.n_results)
+    result = await _query_engine().submit(request.question, n_results=request.n_results)
     
     return QueryResponse(
         query=result['query'],
@@ -107,6 +165,9 @@ async def query(request: QueryRequest):
 @app.post("/api/ingest", response_model=IngestResponse)
 async def ingest(request: IngestRequest):
     """Ingest a single document by URL"""
+    from scraper import download_pdf
+    from processor import extract_pdf_with_metadata
+    
     try:
         os.makedirs(DOCUMENTS_DIR, exist_ok=True)
         
@@ -117,8 +178,8 @@ async def ingest(request: IngestRequest):
             'type': 'pdf'
         }
         
-        # Download
-        local_path = download_pdf(doc)
+        # Download (Playwright's sync API, so keep it off the event loop)
+        local_path = await asyncio.to_thread(download_pdf, doc)
         if not local_path:
             return IngestResponse(
                 success=False,
@@ -126,20 +187,29 @@ async def ingest(request: IngestRequest):
             )
         
         # Process
-        chunks = extract_pdf_with_metadata(
+        chunks = await asyncio.to_thread(
+            extract_pdf_with_metadata,
             pdf_path=local_path,
             source_url=request.url,
             title=doc['title']
         )
         
+        if chunks is None:
+            return IngestResponse(
+                success=False,
+                message="The downloaded PDF could not be opened"
+            )
+        
         if not chunks:
+            # Don't leave chunks of an older copy of this PDF searchable
+            await asyncio.to_thread(_vectorstore().delete_by_source, request.url)
             return IngestResponse(
                 success=False,
                 message="No text could be extracted from the PDF"
             )
         
-        # Index
-        added = add_documents(chunks)
+        # Index (chunks of an older copy of the PDF are replaced)
+        added = await asyncio.to_thread(_vectorstore().add_documents, chunks)
         
         return IngestResponse(
             success=True,
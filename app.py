@@ -2,7 +2,7 @@
 BNM Policy Chatbot - Streamlit UI
 """
 import streamlit as st
-from rag import query, check_ollama_connection
+from rag import query_stream, check_ollama_connection
 from vectorstore import get_stats
 from config import APP_TITLE, APP_DESCRIPTION, LLM_MODEL
 
@@ -48,27 +48,35 @@ def init_session_state():
     """Initialize session state variables"""
     if 'chat_history' not in st.session_state:
         st.session_state.chat_history = []
-    if 'ollama_ok' not in st.session_state:
-        st.session_state.ollama_ok = None
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_stats() -> dict:
+    """Vector store stats, refreshed at most every 30s across reruns"""
+    return get_stats()
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _cached_ollama_status() -> bool:
+    """Ollama availability, refreshed at most every 60s across reruns"""
+    return check_ollama_connection()
 
 
 def check_system_status():
     """Check if the system is ready"""
     # Check vector store
     try:
-        stats = get_stats()
+        stats = _cached_stats()
         vector_ok = stats['total_chunks'] > 0
     except Exception:
         vector_ok = False
         stats = {'total_chunks': 0}
     
-    # Check Ollama (cache the result)
-    if st.session_state.ollama_ok is None:
-        st.session_state.ollama_ok = check_ollama_connection()
+    ollama_ok = _cached_ollama_status()
     
     return {
         'vector_ok': vector_ok,
-        'ollama_ok': st.session_state.ollama_ok,
+        'ollama_ok': ollama_ok,
         'chunk_count': stats['total_chunks']
     }
 
@@ -173,21 +181,21 @@ def main():
         with st.chat_message("user"):
             st.write(user_query)
         
-        # Generate response
+        # Generate response, streaming tokens as they arrive
         with st.chat_message("assistant"):
-            with st.spinner("Searching policies and generating answer..."):
-                result = query(user_query, n_results=n_results)
+            with st.spinner("Searching policies..."):
+                answer_stream, sources = query_stream(user_query, n_results=n_results)
             
-            st.markdown(result['answer'])
+            answer = st.write_stream(answer_stream)
             
             if show_sources:
-                display_sources(result['sources'])
+                display_sources(sources)
         
         # Save to history
         st.session_state.chat_history.append({
             'query': user_query,
-            'answer': result['answer'],
-            'sources': result['sources']
+            'answer': answer,
+            'sources': sources
         })
 
 
@@ -8,7 +8,10 @@ import os
 # =============================================================================
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DOCUMENTS_DIR = os.path.join(BASE_DIR, "documents", "bnm")
+HTML_CACHE_DIR = os.path.join(DOCUMENTS_DIR, "html_cache")  # Scraped pages + ETag/Last-Modified
 CHROMA_DB_PATH = os.path.join(BASE_DIR, "chroma_db")
+PROCESSED_CACHE_DIR = os.path.join(BASE_DIR, ".cache", "processed")  # Extracted chunks per PDF
+PROCESSED_CACHE_MAX_MB = 500  # Least recently used extraction results are pruned beyond this
 
 # =============================================================================
 # BNM SCRAPING
@@ -20,7 +23,9 @@ BNM_POLICY_URLS = [
 ]
 
 # Request settings
+DOWNLOAD_CONCURRENCY = 4   # Parallel document downloads during ingest
 REQUEST_TIMEOUT = 30
+BROWSER_STATE_TTL = 600    # Seconds to reuse browser cookies (AWS WAF token) before re-challenging
 REQUEST_HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
 }
@@ -40,6 +45,8 @@ LLM_MODEL = "llama3.1:8b"       # Best balance of quality/speed (~4.7GB)
 # Generation settings
 LLM_TEMPERATURE = 0.1  # Low for factual responses
 LLM_MAX_TOKENS = 2048
+LLM_NUM_CTX = 4096      # Context window; fixed so prompts are never truncated/shifted
+LLM_KEEP_ALIVE = "30m"  # Keep model (and its prompt KV cache) loaded between queries
 
 # =============================================================================
 # EMBEDDING SETTINGS
@@ -52,6 +59,13 @@ EMBEDDING_MODEL = "all-MiniLM-L6-v2"  # Fast, decent quality
 # EMBEDDING_TYPE = "ollama"
 # EMBEDDING_MODEL = "nomic-embed-text"
 
+EMBED_BATCH_SIZE = 256  # Texts per embedding call (length-sorted); lower if GPU memory is tight
+
+# Note: Chroma stores and searches vectors as float32 whatever the model
+# outputs (int8/float16 inputs are upcast), so index size is set by the
+# model's dimension: all-MiniLM-L6-v2 = 384 dims = ~1.5 KB per chunk,
+# nomic-embed-text = 768 dims = ~3 KB per chunk.
+
 # =============================================================================
 # CHUNKING SETTINGS
 # =============================================================================
@@ -64,6 +78,20 @@ CHUNK_SEPARATORS = ["\n\n", "\n", ". ", " "]
 # =============================================================================
 RETRIEVAL_TOP_K = 5        # Number of chunks to retrieve
 COLLECTION_NAME = "bnm_policies"
+# HNSW candidate list size at query time (recall vs speed). Chroma copies
+# HNSW params into the index when the collection is created, so changing
+# this only affects a new collection: rebuild with `python ingest.py --clear`.
+HNSW_SEARCH_EF = 64
+QUERY_BATCH_SIZE = 16      # Max API queries retrieved in one batched search
+QUERY_BATCH_WAIT = 0.05    # Seconds to wait for more queries to join a batch
+
+# =============================================================================
+# QUERY CACHE SETTINGS
+# =============================================================================
+QUERY_CACHE_TTL = 3600           # Seconds before a cached answer expires
+QUERY_CACHE_SIZE = 512           # Max answers kept in memory
+QUERY_CACHE_SIMILARITY = 0.97    # Cosine threshold for a semantic cache hit
+QUERY_CACHE_PATH = os.path.join(BASE_DIR, "rag_cache.db")  # Set to None to disable disk cache
 
 # =============================================================================
 # UI SETTINGS
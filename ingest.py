@@ -10,20 +10,19 @@ This script:
 
 Run this initially and then weekly via cron/scheduler.
 """
+import os
 import sys
+import asyncio
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
+from tqdm import tqdm
 
-from scraper import (
-    scrape_all_documents,
-    download_all_documents,
-    save_document_index,
-    load_document_index
-)
-from processor import process_documents, get_document_stats
-from vectorstore import add_documents, get_stats, clear_collection
-from rag import check_ollama_connection
-from config import LLM_MODEL
+# Pipeline modules (Playwright, PyMuPDF, chromadb, sentence-transformers) are
+# imported inside the functions that need them, so each CLI mode only pays
+# for what it uses
+from config import LLM_MODEL, DOWNLOAD_CONCURRENCY
 
 
 def print_header(text: str):
@@ -33,19 +32,201 @@ def print_header(text: str):
     print("=" * 60)
 
 
-def run_full_pipeline(skip_download: bool = False, clear_existing: bool = False):
+async def run_pipeline(documents: list[dict], download: bool = True,
+                       use_cache: bool = True,
+                       clear_existing: bool = False) -> tuple[list[dict], list[dict], int]:
+    """
+    Download, extract and index documents as a streaming pipeline.
+    
+    Downloads run in threads, PDF extraction in a process pool and indexing
+    in batches, connected by queues so that document N+1 downloads while
+    document N is extracted and earlier chunks are being embedded.
+    
+    Args:
+        documents: Document metadata dicts (with 'local_path' if not downloading)
+        download: If False, only process documents already on disk
+        use_cache: If False, re-extract PDFs even if cached chunks exist
+        clear_existing: If True, clear the vector DB just before the first
+            insert, so a run that indexes nothing leaves it untouched
+        
+    Returns:
+        Tuple of (processed_documents, all_chunks, chunks_added)
+    """
+    from scraper import claim_url, download_document
+    from processor import POOL_CONTEXT, extract_pdf_with_metadata, init_extraction_worker, prune_chunk_cache
+    from vectorstore import add_documents, clear_collection, delete_by_source
+    
+    loop = asyncio.get_running_loop()
+    n_extractors = min(4, os.cpu_count() or 1)
+    extract_q = asyncio.Queue()
+    embed_q = asyncio.Queue()
+    
+    processed = []
+    all_chunks = []
+    added = 0
+    progress = tqdm(total=len(documents), desc="Processing PDFs")
+    
+    async def downloader():
+        semaphore = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+        # Resolved PDF URLs, so a PDF reached through several links is
+        # downloaded and indexed once (chunk staleness is per source URL)
+        claimed = set()
+        
+        async def fetch(doc):
+            async with semaphore:
+                if download:
+                    doc = await loop.run_in_executor(None, download_document, doc, claimed)
+                elif 'local_path' not in doc or not claim_url(doc['url'], claimed):
+                    doc = None
+            
+            if doc:
+                await extract_q.put(doc)
+            else:
+                progress.update(1)
+        
+        await asyncio.gather(*(fetch(doc) for doc in documents))
+        for _ in range(n_extractors):
+            await extract_q.put(None)
+    
+    def new_pool():
+        return ProcessPoolExecutor(max_workers=n_extractors, mp_context=POOL_CONTEXT,
+                                   initializer=init_extraction_worker)
+    
+    pool = new_pool()
+    
+    async def extract(doc):
+        """Extract one PDF in the pool, replacing the pool if a worker dies"""
+        nonlocal pool
+        # A dead worker (e.g. MuPDF segfault, OOM kill) fails every document
+        # in flight, so each gets one retry on a fresh pool; a PDF that
+        # breaks the pool twice is skipped
+        for attempt in range(2):
+            current = pool
+            try:
+                return await loop.run_in_executor(
+                    current,
+                    extract_pdf_with_metadata,
+                    doc['local_path'],
+                    doc['url'],
+                    doc.get('title'),
+                    use_cache
+                )
+            except BrokenProcessPool:
+                if pool is current:
+                    print("  An extraction worker died; restarting the pool")
+                    current.shutdown(wait=False)
+                    pool = new_pool()
+            except Exception as e:
+                print(f"  Error processing {doc['local_path']}: {e}")
+                return None
+        
+        print(f"  Skipping {doc['local_path']}: extraction keeps crashing its worker")
+        return None
+    
+    async def extractor():
+        while (doc := await extract_q.get()) is not None:
+            chunks = await extract(doc)
+            
+            processed.append(doc)
+            progress.update(1)
+            # Failed extractions (including PDFs that don't open) leave the
+            # index alone; an empty result from a PDF that opened still goes
+            # to the indexer to drop older chunks of the PDF
+            if chunks is not None:
+                all_chunks.extend(chunks)
+                await embed_q.put((chunks, doc['url']))
+        
+        await embed_q.put(None)
+    
+    def index_batch(batch, emptied):
+        nonlocal clear_existing
+        if clear_existing and batch:
+            print("Clearing existing index...")
+            clear_collection()
+            clear_existing = False
+        
+        # The current copy of these PDFs has no text, so any chunks left
+        # from an older copy are stale (add_documents replaces the rest)
+        for source_url in emptied:
+            delete_by_source(source_url)
+        
+        return add_documents(batch) if batch else 0
+    
+    async def indexer():
+        nonlocal added
+        pending = []
+        emptied = []
+        finished = 0
+        receiving = asyncio.ensure_future(embed_q.get())
+        indexing = None
+        
+        # Each insert takes everything extracted while the previous one ran,
+        # so batches grow with the backlog and add_documents can use bulk
+        # inserts (overlapping embedding with writes) instead of small calls
+        while receiving or indexing or pending or emptied:
+            if (pending or emptied) and indexing is None:
+                batch, pending = pending, []
+                empty, emptied = emptied, []
+                indexing = loop.run_in_executor(None, index_batch, batch, empty)
+            
+            done, _ = await asyncio.wait(
+                [f for f in (receiving, indexing) if f is not None],
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            
+            if indexing in done:
+                added += indexing.result()
+                indexing = None
+            
+            if receiving in done:
+                item = receiving.result()
+                if item is None:
+                    finished += 1
+                else:
+                    chunks, source_url = item
+                    if chunks:
+                        pending.extend(chunks)
+                    elif not clear_existing:
+                        emptied.append(source_url)
+                receiving = asyncio.ensure_future(embed_q.get()) if finished < n_extractors else None
+    
+    try:
+        await asyncio.gather(
+            downloader(),
+            *(extractor() for _ in range(n_extractors)),
+            indexer()
+        )
+    finally:
+        pool.shutdown()
+    
+    progress.close()
+    
+    removed = prune_chunk_cache()
+    if removed:
+        print(f"Pruned {removed} old extraction cache files")
+    
+    return processed, all_chunks, added
+
+
+def run_full_pipeline(skip_download: bool = False, clear_existing: bool = False,
+                      force_reprocess: bool = False):
     """
     Run the complete ingestion pipeline.
     
     Args:
         skip_download: If True, only process existing documents
         clear_existing: If True, clear vector DB before indexing
+        force_reprocess: If True, ignore cached PDF extraction results
     """
+    from scraper import scrape_all_documents, save_document_index, load_document_index
+    from processor import get_document_stats
+    from vectorstore import get_stats
+    
     start_time = datetime.now()
     print_header("BNM Policy Document Ingestion Pipeline")
     print(f"Started at: {start_time.strftime('%Y-%m-%d %H:%M:%S')}")
     
-    # Step 1: Scrape and download documents
+    # Step 1: Scrape document links
     if not skip_download:
         print_header("Step 1: Scraping BNM Website")
         documents = scrape_all_documents()
@@ -55,19 +236,8 @@ def run_full_pipeline(skip_download: bool = False, clear_existing: bool = False)
             sys.exit(1)
         
         print(f"\nFound {len(documents)} document links")
-        
-        print_header("Step 2: Downloading PDFs")
-        documents = download_all_documents(documents)
-        
-        if not documents:
-            print("No documents downloaded successfully.")
-            sys.exit(1)
-        
-        # Save document index
-        save_document_index(documents)
-        print(f"\nDownloaded {len(documents)} documents")
     else:
-        print_header("Step 1-2: Loading Existing Documents")
+        print_header("Step 1: Loading Existing Documents")
         documents = load_document_index()
         
         if not documents:
@@ -76,9 +246,25 @@ def run_full_pipeline(skip_download: bool = False, clear_existing: bool = False)
         
         print(f"Loaded {len(documents)} documents from index")
     
-    # Step 3: Process PDFs
-    print_header("Step 3: Processing PDFs")
-    chunks = process_documents(documents)
+    # Steps 2-4: Download, process and index (overlapped)
+    if skip_download:
+        print_header("Steps 3-4: Processing and Indexing PDFs")
+    else:
+        print_header("Steps 2-4: Downloading, Processing and Indexing PDFs")
+    
+    documents, chunks, added = asyncio.run(
+        run_pipeline(documents, download=not skip_download, use_cache=not force_reprocess,
+                     clear_existing=clear_existing)
+    )
+    
+    if not skip_download:
+        if not documents:
+            print("No documents downloaded successfully.")
+            sys.exit(1)
+        
+        # Save document index
+        save_document_index(documents)
+        print(f"\nDownloaded {len(documents)} documents")
     
     if not chunks:
         print("No text extracted from documents.")
@@ -90,15 +276,6 @@ def run_full_pipeline(skip_download: bool = False, clear_existing: bool = False)
     print(f"  - Documents processed: {stats['documents']}")
     print(f"  - Avg chunk length: {stats['avg_chunk_length']} chars")
     
-    # Step 4: Index into vector store
-    print_header("Step 4: Indexing to Vector Store")
-    
-    if clear_existing:
-        print("Clearing existing index...")
-        clear_collection()
-    
-    added = add_documents(chunks)
-    
     # Final stats
     final_stats = get_stats()
     print(f"\nVector store stats:")
@@ -117,6 +294,10 @@ def run_full_pipeline(skip_download: bool = False, clear_existing: bool = False)
 
 def run_system_check():
     """Check if all dependencies are ready"""
+    from scraper import load_document_index
+    from vectorstore import get_stats
+    from rag import check_ollama_connection
+    
     print_header("System Check")
     
     all_ok = True
@@ -164,7 +345,7 @@ def run_system_check():
 def add_manual_document(pdf_path: str, source_url: str = None):
     """Add a single document manually"""
     from processor import extract_pdf_with_metadata
-    import os
+    from vectorstore import add_documents
     
     if not os.path.exists(pdf_path):
         print(f"File not found: {pdf_path}")
@@ -176,7 +357,9 @@ def add_manual_document(pdf_path: str, source_url: str = None):
     print(f"Processing: {pdf_path}")
     chunks = extract_pdf_with_metadata(pdf_path, source_url)
     
-    if chunks:
+    if chunks is None:
+        print("Could not open document")
+    elif chunks:
         added = add_documents(chunks)
         print(f"Added {added} chunks to vector store")
     else:
@@ -202,6 +385,11 @@ if __name__ == "__main__":
         action='store_true',
         help='Clear existing vector store before indexing'
     )
+    parser.add_argument(
+        '--force-reprocess',
+        action='store_true',
+        help='Re-extract all PDFs, ignoring cached extraction results'
+    )
     parser.add_argument(
         '--add-pdf',
         type=str,
@@ -223,5 +411,6 @@ if __name__ == "__main__":
     else:
         run_full_pipeline(
             skip_download=args.skip_download,
-            clear_existing=args.clear
+            clear_existing=args.clear,
+            force_reprocess=args.force_reprocess
         )
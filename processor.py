@@ -3,38 +3,142 @@ PDF Processor
 Extracts text from PDFs and chunks them for vector storage
 """
 import os
+import gzip
+import zlib
+import json
+import hashlib
+import threading
+import multiprocessing
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import fitz  # PyMuPDF
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from tqdm import tqdm
 
 from config import (
     CHUNK_SIZE,
     CHUNK_OVERLAP,
-    CHUNK_SEPARATORS
+    CHUNK_SEPARATORS,
+    PROCESSED_CACHE_DIR,
+    PROCESSED_CACHE_MAX_MB
 )
 
 
-def extract_text_from_pdf(pdf_path: str) -> list[dict]:
+# Pages per worker task when extracting large PDFs in parallel
+PAGES_PER_TASK = 16
+
+# Start method for extraction pools. Forking a process that already runs
+# threads (the API server, ingest's downloader) can deadlock the children,
+# so workers come from a clean forkserver (spawn where it's unavailable).
+POOL_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+# Shared pool for page extraction, created on first use (and again after
+# a worker crash breaks it)
+_page_pool = None
+_page_pool_lock = threading.Lock()
+
+# Set in worker processes of a pool that extracts whole PDFs in parallel
+# (e.g. the ingest pipeline), where a nested page pool would oversubscribe
+_in_extraction_worker = False
+
+
+def init_extraction_worker():
+    """Process pool initializer for pools that run extract_pdf_with_metadata"""
+    global _in_extraction_worker
+    _in_extraction_worker = True
+
+
+def _get_page_pool() -> ProcessPoolExecutor:
+    """Get the process pool used for parallel page extraction"""
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is None:
+            _page_pool = ProcessPoolExecutor(max_workers=min(8, os.cpu_count() or 1), mp_context=POOL_CONTEXT)
+        return _page_pool
+
+
+def _reset_page_pool(pool: ProcessPoolExecutor):
+    """Drop a broken page pool so the next large PDF starts a fresh one"""
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is pool:
+            _page_pool = None
+    pool.shutdown(wait=False)
+
+
+def _page_text(page) -> str:
+    """
+    Extract a page's text as paragraphs in reading order.
+    
+    Uses block-level extraction and keeps only text blocks, so image-only
+    (e.g. scanned) pages come back empty without further processing.
+    """
+    blocks = page.get_text("blocks", sort=True)
+    if not blocks:
+        return ""
+    
+    # Block tuples: (x0, y0, x1, y1, text, block_no, block_type); 0 = text
+    return "\n\n".join(block[4].strip() for block in blocks if block[6] == 0)
+
+
+def _extract_page_range(pdf_path: str, start: int, stop: int) -> list[tuple[int, str]]:
+    """Worker: extract text for pages [start, stop) of a PDF"""
+    with fitz.open(pdf_path) as doc:
+        return [(page_num, _page_text(doc[page_num])) for page_num in range(start, stop)]
+
+
+def extract_text_from_pdf(pdf_path: str) -> list[dict] | None:
     """
     Extract text from PDF with page-level metadata.
     
+    Large PDFs are split into page ranges and extracted in a process pool
+    (PyMuPDF is not thread-safe, so threads would not help).
+    
     Args:
         pdf_path: Path to the PDF file
         
     Returns:
-        List of dicts with 'text' and 'page' keys
+        List of dicts with 'text' and 'page' keys, or None if the PDF
+        could not be opened or crashed extraction (as opposed to [] for a
+        PDF with no text)
     """
     try:
         doc = fitz.open(pdf_path)
     except Exception as e:
         print(f"Error opening PDF {pdf_path}: {e}")
-        return []
+        return None
+    
+    page_count = len(doc)
+    
+    # PDFs are already extracted in parallel by the caller's pool: stay serial
+    if page_count <= PAGES_PER_TASK or _in_extraction_worker:
+        page_texts = [(page_num, _page_text(doc[page_num])) for page_num in range(page_count)]
+        doc.close()
+    else:
+        doc.close()
+        starts = range(0, page_count, PAGES_PER_TASK)
+        pool = _get_page_pool()
+        try:
+            results = pool.map(
+                _extract_page_range,
+                [pdf_path] * len(starts),
+                starts,
+                [min(start + PAGES_PER_TASK, page_count) for start in starts]
+            )
+            page_texts = [item for page_range in results for item in page_range]
+        except (BrokenProcessPool, RuntimeError):
+            # A worker died (e.g. MuPDF crashed on a malformed PDF), or another
+            # thread shut this pool down after such a crash (RuntimeError on
+            # submit). Replace the pool for later PDFs; extracting this one
+            # in-process could crash the caller, so treat it as unreadable.
+            print(f"Page extraction pool broke on {pdf_path}, skipping it")
+            _reset_page_pool(pool)
+            return None
     
     pages = []
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        text = page.get_text()
-        
+    for page_num, text in page_texts:
         # Clean up text
         text = text.strip()
         if text:  # Only include non-empty pages
@@ -43,10 +147,20 @@ def extract_text_from_pdf(pdf_path: str) -> list[dict]:
                 'page': page_num + 1  # 1-indexed
             })
     
-    doc.close()
     return pages
 
 
+@lru_cache(maxsize=1)
+def _get_splitter() -> RecursiveCharacterTextSplitter:
+    """Get the shared text splitter (built once, reused for every page)"""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        separators=CHUNK_SEPARATORS,
+        length_function=len
+    )
+
+
 def chunk_text(text: str, metadata: dict) -> list[dict]:
     """
     Split text into chunks with metadata.
@@ -58,14 +172,7 @@ def chunk_text(text: str, metadata: dict) -> list[dict]:
     Returns:
         List of chunk dicts with 'content' and 'metadata' keys
     """
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
-        separators=CHUNK_SEPARATORS,
-        length_function=len
-    )
-    
-    chunks = splitter.split_text(text)
+    chunks = _get_splitter().split_text(text)
     
     return [
         {
@@ -79,29 +186,158 @@ def chunk_text(text: str, metadata: dict) -> list[dict]:
     ]
 
 
-def extract_pdf_with_metadata(pdf_path: str, source_url: str, title: str = None) -> list[dict]:
+# Bump when extraction or chunking output changes, to invalidate cached chunks
+# (indexed chunks from an older version are replaced on the next ingest)
+EXTRACTION_CACHE_VERSION = 2
+
+
+def _source_version(pdf_path: str) -> str:
+    """
+    Identify the copy of a PDF and the extraction that produced its chunks.
+    
+    Stored in chunk metadata so the vector store can tell chunks of an
+    older copy, or from an older EXTRACTION_CACHE_VERSION, apart from the
+    current ones (they share chunk IDs) and replace them.
+    """
+    try:
+        stat = os.stat(pdf_path)
+    except OSError:
+        return f"{EXTRACTION_CACHE_VERSION}"
+    return f"{EXTRACTION_CACHE_VERSION}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _chunk_cache_path(pdf_path: str, source_url: str, title: str) -> str | None:
+    """
+    Cache file for a PDF's chunks.
+    
+    The key covers the file's mtime and size plus every input that ends up
+    in the chunks, so edits to the PDF or chunk settings miss the cache.
+    """
+    try:
+        stat = os.stat(pdf_path)
+    except OSError:
+        return None
+    
+    key = hashlib.sha256(
+        f"{EXTRACTION_CACHE_VERSION}|{pdf_path}|{stat.st_mtime}|{stat.st_size}|"
+        f"{source_url}|{title}|{CHUNK_SIZE}|{CHUNK_OVERLAP}|{CHUNK_SEPARATORS}".encode()
+    ).hexdigest()
+    return os.path.join(PROCESSED_CACHE_DIR, f"{key}.jsonl.gz")
+
+
+def _load_cached_chunks(cache_path: str) -> list[dict] | None:
+    """Read chunks from a gzipped JSON Lines cache file, if present"""
+    try:
+        with gzip.open(cache_path, 'rt', encoding='utf-8') as f:
+            chunks = [json.loads(line) for line in f]
+    except (OSError, ValueError, EOFError, zlib.error):
+        # Missing, truncated or corrupt: re-extract
+        return None
+    
+    # Mark as recently used (atime is unreliable with noatime/relatime mounts)
+    try:
+        os.utime(cache_path)
+    except OSError:
+        pass
+    return chunks
+
+
+def _save_cached_chunks(cache_path: str, chunks: list[dict]):
+    """Write chunks to a gzipped JSON Lines cache file"""
+    os.makedirs(PROCESSED_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    
+    try:
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            for chunk in chunks:
+                f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"Could not cache chunks for {cache_path}: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def prune_chunk_cache(max_mb: int = PROCESSED_CACHE_MAX_MB) -> int:
+    """
+    Delete the least recently used cached chunk files beyond max_mb.
+    
+    Cache keys change with every new copy of a PDF, title or
+    EXTRACTION_CACHE_VERSION, so without pruning old entries pile up.
+    
+    Returns:
+        Number of files removed
+    """
+    try:
+        entries = list(os.scandir(PROCESSED_CACHE_DIR))
+    except OSError:
+        return 0
+    
+    files = []
+    for entry in entries:
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, entry.path))
+    
+    # Keep the most recently used files that fit in the budget
+    budget = max_mb * 1024 * 1024
+    removed = 0
+    for _, size, path in sorted(files, reverse=True):
+        if budget >= size:
+            budget -= size
+            continue
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError:
+            pass
+    
+    return removed
+
+
+def extract_pdf_with_metadata(pdf_path: str, source_url: str, title: str = None,
+                              use_cache: bool = True) -> list[dict] | None:
     """
     Full extraction pipeline: PDF → text → chunks with metadata.
     
+    Results are cached on disk per PDF and reused while the file is
+    unchanged (same mtime and size); see prune_chunk_cache for eviction.
+    
     Args:
         pdf_path: Path to the PDF file
         source_url: Original URL of the document
         title: Document title (optional)
+        use_cache: If False, always re-extract (the cache is still refreshed)
         
     Returns:
-        List of chunk dicts ready for vector storage
+        List of chunk dicts ready for vector storage, or None if the PDF
+        could not be opened
     """
     if title is None:
         title = os.path.basename(pdf_path).replace('.pdf', '')
     
+    cache_path = _chunk_cache_path(pdf_path, source_url, title)
+    if use_cache and cache_path:
+        cached = _load_cached_chunks(cache_path)
+        if cached is not None:
+            return cached
+    
     # Extract text by page
     pages = extract_text_from_pdf(pdf_path)
     
+    if pages is None:
+        return None
+    
     if not pages:
         print(f"No text extracted from {pdf_path}")
         return []
     
     all_chunks = []
+    source_version = _source_version(pdf_path)
     
     for page_data in pages:
         # Create metadata for this page
@@ -110,42 +346,17 @@ def extract_pdf_with_metadata(pdf_path: str, source_url: str, title: str = None)
             'pdf_path': pdf_path,
             'title': title,
             'page': page_data['page'],
-            'total_pages': len(pages)
+            'total_pages': len(pages),
+            'source_version': source_version
         }
         
         # Chunk the page text
         page_chunks = chunk_text(page_data['text'], page_metadata)
         all_chunks.extend(page_chunks)
     
-    return all_chunks
-
-
-def process_documents(documents: list[dict]) -> list[dict]:
-    """
-    Process multiple documents and return all chunks.
-    
-    Args:
-        documents: List of document metadata dicts with 'local_path', 'url', 'title'
-        
-    Returns:
-        List of all chunks from all documents
-    """
-    all_chunks = []
-    
-    print(f"\nProcessing {len(documents)} documents...")
-    for doc in tqdm(documents, desc="Processing PDFs"):
-        if 'local_path' not in doc:
-            continue
-            
-        chunks = extract_pdf_with_metadata(
-            pdf_path=doc['local_path'],
-            source_url=doc['url'],
-            title=doc.get('title')
-        )
-        
-        all_chunks.extend(chunks)
+    if cache_path:
+        _save_cached_chunks(cache_path, all_chunks)
     
-    print(f"Total chunks created: {len(all_chunks)}")
     return all_chunks
 
 
@@ -177,7 +388,7 @@ if __name__ == "__main__":
             source_url=f"file://{pdf_path}"
         )
         
-        print(f"\nExtracted {len(chunks)} chunks")
+        print(f"\nExtracted {len(chunks or [])} chunks")
         
         if chunks:
             print("\nSample chunk:")
@@ -2,17 +2,42 @@
 RAG (Retrieval Augmented Generation) Module
 Combines retrieval with local LLM for question answering
 """
+import asyncio
+import atexit
+import hashlib
+import shelve
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from functools import wraps
+
+import numpy as np
 import ollama
-from vectorstore import search
+from vectorstore import search, search_batch, embed_query, embed_queries, get_index_version
 
 from config import (
     LLM_MODEL,
     LLM_TEMPERATURE,
+    LLM_NUM_CTX,
+    LLM_KEEP_ALIVE,
     RETRIEVAL_TOP_K,
-    OLLAMA_BASE_URL
+    OLLAMA_BASE_URL,
+    QUERY_CACHE_TTL,
+    QUERY_CACHE_SIZE,
+    QUERY_CACHE_SIMILARITY,
+    QUERY_CACHE_PATH,
+    QUERY_BATCH_SIZE,
+    QUERY_BATCH_WAIT
 )
 
 
+# Shared clients, so HTTP connections to Ollama are kept alive and reused
+_OLLAMA = ollama.Client(host=OLLAMA_BASE_URL)
+_OLLAMA_ASYNC = ollama.AsyncClient(host=OLLAMA_BASE_URL)
+
+
 # System prompt for the chatbot
 SYSTEM_PROMPT = """You are a helpful assistant that answers questions about Malaysian banking regulations and policies from Bank Negara Malaysia (BNM).
 
@@ -29,43 +54,358 @@ Format guidelines:
 - For complex answers, organize with clear structure
 - Include relevant page numbers when citing"""
 
+# User prompt template. SYSTEM_PROMPT and everything before {context} stay
+# byte-identical across queries so Ollama can reuse their cached KV prefix.
+_PROMPT_TEMPLATE = """Context from BNM policy documents:
+{context}
+
+---
+
+Question: {query}
+
+Answer based only on the context provided above. Cite sources using [Source N] notation."""
+
+_SYSTEM_MESSAGE = {'role': 'system', 'content': SYSTEM_PROMPT}
+
+_LLM_OPTIONS = {
+    'temperature': LLM_TEMPERATURE,
+    'num_ctx': LLM_NUM_CTX
+}
+
+# Prefix of answers returned when the LLM call fails (never cached)
+GENERATION_ERROR = "Error generating response"
+
+NO_RESULTS_ANSWER = "I couldn't find any relevant information in the policy documents. Try rephrasing your question or check if documents have been indexed."
+
+
+@dataclass
+class CacheSlot:
+    """Where a query's result goes in the cache; returned by QueryCache lookups"""
+    key: str
+    scope: tuple                           # (n_results, index_version)
+    embedding: list[float] | None = None   # question embedding, reused for retrieval
+
+
+class QueryCache:
+    """
+    Two-tier answer cache: an in-memory LRU backed by an optional shelve file.
+    
+    Exact hits are keyed by SHA256 of the normalized question, n_results and
+    the index version. On an exact miss, cached questions with the same scope
+    are compared by embedding cosine similarity for a semantic hit.
+    
+    Entries evicted from memory (and those still in memory at exit) spill
+    to the shelve file; a disk hit moves the entry back into memory. Expired
+    entries and entries for an older index version are pruned from the file
+    when it is first opened.
+    """
+    
+    def __init__(self, ttl: int, maxsize: int, threshold: float, path: str = None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.path = path
+        self._entries = OrderedDict()  # key -> (timestamp, value, scope)
+        self._sem_keys = []            # cache keys, row-aligned with _sem_matrix
+        self._sem_scopes = []          # (n_results, index_version) per row
+        self._sem_matrix = None        # unit-norm question embeddings
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()  # shelve allows no concurrent access
+        self._pruned = False
+        
+        if path:
+            atexit.register(self.flush)
+    
+    @staticmethod
+    def normalize(question: str) -> str:
+        return " ".join(question.lower().split())
+    
+    @staticmethod
+    def make_key(norm: str, n_results: int, version: int) -> str:
+        return hashlib.sha256(f"{norm}|{n_results}|{version}".encode()).hexdigest()
+    
+    def _fresh(self, entry) -> bool:
+        return entry is not None and time.time() - entry[0] < self.ttl
+    
+    def _open_disk(self):
+        """Open the shelve file (disk lock held), pruning it on first use"""
+        db = shelve.open(self.path)
+        if not self._pruned:
+            self._pruned = True
+            version = get_index_version()
+            stale = [
+                key for key, entry in db.items()
+                if len(entry) != 3 or not self._fresh(entry) or not entry[2] or entry[2][1] != version
+            ]
+            for key in stale:
+                del db[key]
+        return db
+    
+    def _spill(self, entries: list[tuple]):
+        """Write (key, entry) pairs for the current index version to the shelve file"""
+        if not self.path or not entries:
+            return
+        
+        version = get_index_version()
+        entries = [(key, entry) for key, entry in entries if entry[2] and entry[2][1] == version]
+        if not entries:
+            return
+        
+        try:
+            with self._disk_lock, self._open_disk() as db:
+                for key, entry in entries:
+                    db[key] = entry
+        except Exception as e:
+            print(f"Could not persist query cache entries: {e}")
+    
+    def get(self, key: str):
+        """Exact lookup in memory, then on disk"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if self._fresh(entry):
+                self._entries.move_to_end(key)
+                return entry[1]
+        
+        if self.path:
+            try:
+                with self._disk_lock, self._open_disk() as db:
+                    entry = db.pop(key, None)
+            except Exception:
+                entry = None
+            if self._fresh(entry):
+                with self._lock:
+                    self._entries[key] = entry
+                    evicted = self._evict()
+                self._spill(evicted)
+                return entry[1]
+        
+        return None
+    
+    def get_similar(self, embedding: np.ndarray, scope: tuple):
+        """Return the cached value of the closest question above threshold"""
+        with self._lock:
+            if self._sem_matrix is None or not self._sem_keys:
+                return None
+            
+            sims = self._sem_matrix @ embedding
+            for row, row_scope in enumerate(self._sem_scopes):
+                if row_scope != scope:
+                    sims[row] = -1.0
+            
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                return None
+            
+            entry = self._entries.get(self._sem_keys[best])
+            if not self._fresh(entry):
+                return None
+            return entry[1]
+    
+    def put(self, key: str, value: dict, embedding: np.ndarray = None, scope: tuple = None):
+        with self._lock:
+            self._entries[key] = (time.time(), value, scope)
+            self._entries.move_to_end(key)
+            
+            if embedding is not None and key not in self._sem_keys:
+                row = embedding[np.newaxis, :]
+                self._sem_matrix = row if self._sem_matrix is None else np.vstack([self._sem_matrix, row])
+                self._sem_keys.append(key)
+                self._sem_scopes.append(scope)
+            
+            evicted = self._evict()
+        
+        self._spill(evicted)
+    
+    def _evict(self) -> list[tuple]:
+        """Drop least recently used entries beyond maxsize (lock held) and return the fresh ones"""
+        evicted = []
+        while len(self._entries) > self.maxsize:
+            key, entry = self._entries.popitem(last=False)
+            if self._fresh(entry):
+                evicted.append((key, entry))
+            if key in self._sem_keys:
+                row = self._sem_keys.index(key)
+                del self._sem_keys[row]
+                del self._sem_scopes[row]
+                self._sem_matrix = np.delete(self._sem_matrix, row, axis=0)
+        return evicted
+    
+    def flush(self):
+        """Write the fresh in-memory entries to the shelve file (run at exit)"""
+        with self._lock:
+            entries = [(key, entry) for key, entry in self._entries.items() if self._fresh(entry)]
+        self._spill(entries)
+    
+    @staticmethod
+    def _unit(embedding: list[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+    
+    def lookup_exact(self, question: str, n_results: int) -> tuple[dict | None, CacheSlot]:
+        """
+        Find a cached result for exactly this (normalized) question.
+        
+        Returns:
+            Tuple of (cached_result or None, slot) where slot is passed
+            to lookup_similar() and store() on a miss
+        """
+        scope = (n_results, get_index_version())
+        slot = CacheSlot(key=self.make_key(self.normalize(question), *scope), scope=scope)
+        
+        cached = self.get(slot.key)
+        if cached is not None:
+            return {**cached, 'query': question}, slot
+        return None, slot
+    
+    def lookup_similar(self, question: str, slot: CacheSlot, embedding: list[float]) -> dict | None:
+        """
+        Find a cached result for a near-identical question.
+        
+        The embedding is kept on the slot, so retrieval can reuse it
+        instead of embedding the question again.
+        """
+        slot.embedding = embedding
+        cached = self.get_similar(self._unit(embedding), slot.scope)
+        if cached is not None:
+            return {**cached, 'query': question}
+        return None
+    
+    def lookup(self, question: str, n_results: int) -> tuple[dict | None, CacheSlot]:
+        """
+        Find a cached result for a question, exact first, then semantic.
+        
+        Returns:
+            Tuple of (cached_result or None, slot) where slot is passed
+            back to store() on a miss; slot.embedding holds the question's
+            embedding if it was computed
+        """
+        cached, slot = self.lookup_exact(question, n_results)
+        if cached is not None:
+            return cached, slot
+        
+        # Semantic fallback on near-identical questions
+        try:
+            cached = self.lookup_similar(question, slot, embed_query(question))
+        except Exception as e:
+            print(f"Semantic cache lookup failed: {e}")
+        
+        return cached, slot
+    
+    def store(self, slot: CacheSlot, result: dict):
+        """Cache a result for a slot returned by lookup(), unless it is an error"""
+        if not result['answer'].startswith(GENERATION_ERROR):
+            embedding = self._unit(slot.embedding) if slot.embedding is not None else None
+            self.put(slot.key, result, embedding, slot.scope)
+
 
-def build_context(results: dict) -> tuple[str, list[dict]]:
+def semantic_cache(ttl: int = QUERY_CACHE_TTL):
     """
-    Build context string and source list from search results.
+    Cache full query() results, keyed on the normalized question.
+    
+    The index version is part of the key, so answers are invalidated
+    whenever documents are added to or removed from the vector store.
+    """
+    cache = QueryCache(
+        ttl=ttl,
+        maxsize=QUERY_CACHE_SIZE,
+        threshold=QUERY_CACHE_SIMILARITY,
+        path=QUERY_CACHE_PATH
+    )
+    
+    def decorator(func):
+        @wraps(func)
+        def wrapper(question: str, n_results: int = None) -> dict:
+            if n_results is None:
+                n_results = RETRIEVAL_TOP_K
+            
+            cached, slot = cache.lookup(question, n_results)
+            if cached is not None:
+                return cached
+            
+            result = func(question, n_results=n_results, query_embedding=slot.embedding)
+            cache.store(slot, result)
+            return result
+        
+        wrapper.cache = cache
+        return wrapper
+    
+    return decorator
+
+
+@dataclass
+class SourceBatch:
+    """Source references for one query, stored as parallel lists"""
+    indices: list[int] = field(default_factory=list)
+    titles: list[str] = field(default_factory=list)
+    pages: list[int] = field(default_factory=list)
+    urls: list[str] = field(default_factory=list)
+    snippets: list[str] = field(default_factory=list)
+    full_texts: list[str] = field(default_factory=list)
+    scores: list[float] = field(default_factory=list)
+    
+    def __len__(self) -> int:
+        return len(self.indices)
+    
+    def to_dicts(self) -> list[dict]:
+        """Convert to the list-of-dicts form returned by query()"""
+        return [
+            {
+                'index': index,
+                'title': title,
+                'page': page,
+                'url': url,
+                'snippet': snippet,
+                'full_text': full_text,
+                'relevance_score': score
+            }
+            for index, title, page, url, snippet, full_text, score in zip(
+                self.indices, self.titles, self.pages, self.urls,
+                self.snippets, self.full_texts, self.scores
+            )
+        ]
+
+
+def build_context(results: dict[str, list[list]]) -> tuple[str, SourceBatch]:
+    """
+    Build context string and source batch from search results.
     
     Returns:
-        Tuple of (context_string, sources_list)
+        Tuple of (context_string, source_batch)
     """
     context_parts = []
-    sources = []
+    sources = SourceBatch()
     
-    for i, (doc, meta, dist) in enumerate(zip(
+    for source_num, (doc, meta, dist) in enumerate(zip(
         results['documents'][0],
         results['metadatas'][0],
         results['distances'][0]
-    )):
+    ), start=1):
         # Build context entry
-        source_num = i + 1
         context_parts.append(
             f"[Source {source_num}] (Document: {meta['title']}, Page {meta['page']}):\n{doc}"
         )
         
         # Build source reference
-        sources.append({
-            'index': source_num,
-            'title': meta['title'],
-            'page': meta['page'],
-            'url': meta['source_url'],
-            'snippet': doc[:300] + "..." if len(doc) > 300 else doc,
-            'full_text': doc,
-            'relevance_score': 1 - dist  # Convert distance to similarity
-        })
+        sources.indices.append(source_num)
+        sources.titles.append(meta['title'])
+        sources.pages.append(meta['page'])
+        sources.urls.append(meta['source_url'])
+        sources.snippets.append(doc[:300] + "..." if len(doc) > 300 else doc)
+        sources.full_texts.append(doc)
+        sources.scores.append(1 - dist)  # Convert distance to similarity
     
     context = "\n\n---\n\n".join(context_parts)
     return context, sources
 
 
+def build_messages(query: str, context: str) -> list[dict]:
+    """Build the chat messages sent to the LLM"""
+    return [
+        _SYSTEM_MESSAGE,
+        {'role': 'user', 'content': _PROMPT_TEMPLATE.format(context=context, query=query)}
+    ]
+
+
 def generate_answer(query: str, context: str) -> str:
     """
     Generate an answer using the local LLM.
@@ -77,60 +417,125 @@ def generate_answer(query: str, context: str) -> str:
     Returns:
         Generated answer string
     """
-    prompt = f"""Context from BNM policy documents:
-{context}
+    try:
+        response = _OLLAMA.chat(
+            model=LLM_MODEL,
+            messages=build_messages(query, context),
+            options=_LLM_OPTIONS,
+            # Ollama reuses the KV cache for the longest matching prompt prefix,
+            # but only while the model stays loaded
+            keep_alive=LLM_KEEP_ALIVE
+        )
+        
+        return response['message']['content']
+    
+    except Exception as e:
+        return f"{GENERATION_ERROR}: {str(e)}. Make sure Ollama is running with `ollama serve`."
 
----
 
-Question: {query}
+async def generate_answer_async(query: str, context: str) -> str:
+    """
+    Async variant of generate_answer() for use inside an event loop.
+    
+    Args:
+        query: User's question
+        context: Retrieved context from documents
+        
+    Returns:
+        Generated answer string
+    """
+    try:
+        response = await _OLLAMA_ASYNC.chat(
+            model=LLM_MODEL,
+            messages=build_messages(query, context),
+            options=_LLM_OPTIONS,
+            keep_alive=LLM_KEEP_ALIVE
+        )
+        
+        return response['message']['content']
+    
+    except Exception as e:
+        return f"{GENERATION_ERROR}: {str(e)}. Make sure Ollama is running with `ollama serve`."
 
-Answer based only on the context provided above. Cite sources using [Source N] notation."""
 
+def generate_answer_stream(query: str, context: str) -> Iterator[str]:
+    """
+    Generate an answer using the local LLM, yielding text as it is produced.
+    
+    Args:
+        query: User's question
+        context: Retrieved context from documents
+        
+    Yields:
+        Pieces of the answer string
+    """
     try:
-        response = ollama.chat(
+        response = _OLLAMA.chat(
             model=LLM_MODEL,
-            messages=[
-                {'role': 'system', 'content': SYSTEM_PROMPT},
-                {'role': 'user', 'content': prompt}
-            ],
-            options={
-                'temperature': LLM_TEMPERATURE
-            }
+            messages=build_messages(query, context),
+            options=_LLM_OPTIONS,
+            keep_alive=LLM_KEEP_ALIVE,
+            stream=True
         )
         
-        return response['message']['content']
+        for chunk in response:
+            yield chunk['message']['content']
     
     except Exception as e:
-        return f"Error generating response: {str(e)}. Make sure Ollama is running with `ollama serve`."
+        yield f"{GENERATION_ERROR}: {str(e)}. Make sure Ollama is running with `ollama serve`."
 
 
-def query(question: str, n_results: int = None) -> dict:
+def retrieve(question: str, n_results: int = None,
+             query_embedding: list[float] = None) -> tuple[str, list[dict]] | None:
     """
-    Full RAG pipeline: retrieve relevant chunks and generate answer.
+    Retrieve relevant chunks and build the LLM context.
     
     Args:
         question: User's question
         n_results: Number of chunks to retrieve (default from config)
-        
+        query_embedding: The question's embedding, if already computed
+    
     Returns:
-        Dict with 'answer', 'sources', and 'query' keys
+        Tuple of (context_string, sources_list), or None if nothing matched
     """
     if n_results is None:
         n_results = RETRIEVAL_TOP_K
     
     # Retrieve relevant documents
-    results = search(question, n_results=n_results)
+    results = search(question, n_results=n_results, query_embedding=query_embedding)
     
     # Check if we got any results
     if not results['documents'][0]:
+        return None
+    
+    # Build context and source list
+    context, sources = build_context(results)
+    return context, sources.to_dicts()
+
+
+@semantic_cache(ttl=QUERY_CACHE_TTL)
+def query(question: str, n_results: int = None, query_embedding: list[float] = None) -> dict:
+    """
+    Full RAG pipeline: retrieve relevant chunks and generate answer.
+    
+    Args:
+        question: User's question
+        n_results: Number of chunks to retrieve (default from config)
+        query_embedding: The question's embedding, if already computed
+        
+    Returns:
+        Dict with 'answer', 'sources', and 'query' keys
+    """
+    retrieved = retrieve(question, n_results=n_results, query_embedding=query_embedding)
+    
+    if retrieved is None:
         return {
             'query': question,
-            'answer': "I couldn't find any relevant information in the policy documents. Try rephrasing your question or check if documents have been indexed.",
+            'answer': NO_RESULTS_ANSWER,
             'sources': []
         }
     
-    # Build context and source list
-    context, sources = build_context(results)
+    context, sources = retrieved
     
     # Generate answer
     answer = generate_answer(question, context)
@@ -142,10 +547,194 @@ def query(question: str, n_results: int = None) -> dict:
     }
 
 
+class BatchedQueryEngine:
+    """
+    Coalesce concurrent async queries into batched retrieval.
+    
+    Queries arriving within QUERY_BATCH_WAIT seconds of each other (up to
+    QUERY_BATCH_SIZE) are embedded once, together; the embeddings serve
+    both the semantic cache lookup and a single vector store search. Their
+    LLM calls then run concurrently.
+    """
+    
+    def __init__(self, max_batch: int = QUERY_BATCH_SIZE, max_wait: float = QUERY_BATCH_WAIT):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = None
+        self._worker = None
+        self._tasks = set()
+    
+    async def submit(self, question: str, n_results: int = None) -> dict:
+        """Answer a question, batching its retrieval with concurrent ones"""
+        if n_results is None:
+            n_results = RETRIEVAL_TOP_K
+        
+        # Exact hits need no embedding; semantic lookup happens per batch
+        cached, slot = await asyncio.to_thread(query.cache.lookup_exact, question, n_results)
+        if cached is not None:
+            return cached
+        
+        # Start the batching loop lazily, inside the running event loop
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((question, n_results, slot, future))
+        return await future
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            # Process in the background so the next batch can start collecting
+            task = asyncio.create_task(self._process(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+    
+    @staticmethod
+    def _resolve(future: asyncio.Future, result: dict = None, error: Exception = None):
+        """Complete a request's future unless it was already cancelled"""
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    
+    async def _process(self, batch: list[tuple]):
+        # Requests cancelled while queued need no work
+        batch = [entry for entry in batch if not entry[3].done()]
+        if not batch:
+            return
+        
+        try:
+            questions = [entry[0] for entry in batch]
+            embeddings = await asyncio.to_thread(embed_queries, questions)
+        except Exception as e:
+            for *_, future in batch:
+                self._resolve(future, error=e)
+            return
+        
+        # Answer near-identical cached questions; search for the rest
+        misses = []
+        for (question, n_results, slot, future), embedding in zip(batch, embeddings):
+            try:
+                cached = query.cache.lookup_similar(question, slot, embedding)
+            except Exception as e:
+                print(f"Semantic cache lookup failed: {e}")
+                cached = None
+            
+            if cached is not None:
+                self._resolve(future, cached)
+            elif not future.done():
+                misses.append((question, n_results, slot, future))
+        
+        if not misses:
+            return
+        batch = misses
+        
+        try:
+            max_results = max(entry[1] for entry in batch)
+            results = await asyncio.to_thread(
+                search_batch,
+                [entry[0] for entry in batch],
+                max_results,
+                [entry[2].embedding for entry in batch]
+            )
+        except Exception as e:
+            for *_, future in batch:
+                self._resolve(future, error=e)
+            return
+        
+        async def answer(i, question, n_results, slot, future):
+            try:
+                item = {
+                    key: [results[key][i][:n_results]]
+                    for key in ('documents', 'metadatas', 'distances')
+                }
+                
+                if not item['documents'][0]:
+                    result = {
+                        'query': question,
+                        'answer': NO_RESULTS_ANSWER,
+                        'sources': []
+                    }
+                else:
+                    context, sources = build_context(item)
+                    result = {
+                        'query': question,
+                        'answer': await generate_answer_async(question, context),
+                        'sources': sources.to_dicts()
+                    }
+                
+                await asyncio.to_thread(query.cache.store, slot, result)
+                self._resolve(future, result)
+            except Exception as e:
+                self._resolve(future, error=e)
+        
+        await asyncio.gather(*(answer(i, *entry) for i, entry in enumerate(batch)))
+
+
+def query_stream(question: str, n_results: int = None) -> tuple[Iterator[str], list[dict]]:
+    """
+    Streaming variant of query() for chat UIs.
+    
+    Cached answers are replayed in one piece; fresh answers are streamed
+    from the LLM and cached once complete.
+    
+    Returns:
+        Tuple of (answer_stream, sources)
+    """
+    if n_results is None:
+        n_results = RETRIEVAL_TOP_K
+    
+    cache = query.cache
+    cached, slot = cache.lookup(question, n_results)
+    if cached is not None:
+        return iter([cached['answer']]), cached['sources']
+    
+    retrieved = retrieve(question, n_results=n_results, query_embedding=slot.embedding)
+    if retrieved is None:
+        return iter([NO_RESULTS_ANSWER]), []
+    
+    context, sources = retrieved
+    
+    def stream():
+        parts = []
+        for piece in generate_answer_stream(question, context):
+            parts.append(piece)
+            yield piece
+        
+        # A failure mid-stream leaves a partial answer; don't cache it
+        if parts and parts[-1].startswith(GENERATION_ERROR):
+            return
+        
+        cache.store(slot, {
+            'query': question,
+            'answer': "".join(parts),
+            'sources': sources
+        })
+    
+    return stream(), sources
+
+
 def check_ollama_connection() -> bool:
     """Check if Ollama is running and model is available"""
     try:
-        response = ollama.list()
+        response = _OLLAMA.list()
         # Handle both old dict format and new object format
         if hasattr(response, 'models'):
             available_models = [m.model for m in response.models]
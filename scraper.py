@@ -6,27 +6,237 @@ Uses Playwright to bypass AWS WAF bot protection
 import os
 import re
 import json
+import time
+import orjson
+import atexit
 import hashlib
+import threading
+import queue
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from bs4 import BeautifulSoup, SoupStrainer
 from urllib.parse import urljoin, urlparse
 from datetime import datetime
 from tqdm import tqdm
-from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeout
+from playwright.sync_api import sync_playwright, Error as PlaywrightError, TimeoutError as PlaywrightTimeout
+
+try:
+    from curl_cffi import requests as cffi
+except ImportError:  # Optional: without it every fetch goes through Playwright
+    cffi = None
 
 from config import (
     BNM_BASE_URL,
     BNM_POLICY_URLS,
     DOCUMENTS_DIR,
+    HTML_CACHE_DIR,
+    DOWNLOAD_CONCURRENCY,
+    BROWSER_STATE_TTL,
     REQUEST_TIMEOUT,
     REQUEST_HEADERS
 )
 
-# Browser instance for reuse
-_browser_context = None
+BROWSER_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+
+# Shared HTTP session: keeps connections to bnm.gov.my alive across downloads
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=8,
+    pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.3)
+))
+
+
+# Saved document metadata (URLs, titles, local paths, download validators)
+DOCUMENT_INDEX_PATH = os.path.join(DOCUMENTS_DIR, "document_index.json")
+
+# Partial downloads older than this (seconds) are treated as abandoned
+PART_FILE_MAX_AGE = 6 * 3600
+
+# Characters not allowed in filenames on common filesystems
+_INVALID_FILENAME_CHARS = re.compile(r'[<>:"/\\|?*]')
+
+# Word separators in filenames, turned into spaces for fallback titles
+_SEPARATORS_TO_SPACES = str.maketrans('-_', '  ')
+
+# Only the elements the scrapers read are parsed into the tree
+_LINK_STRAINER = SoupStrainer('a')
+_POLICY_PAGE_STRAINER = SoupStrainer(['a', 'h1'])
+
+# Browser TLS fingerprint used by curl_cffi to get past AWS WAF without a browser
+CFFI_IMPERSONATE = "chrome124"
+
+# Resources the scrapers never read; aborted in browser contexts to save bandwidth
+_BLOCKED_RESOURCE_TYPES = frozenset({'image', 'font', 'media', 'stylesheet'})
+
+# AWS WAF answers a challenge with 202 (or 405 for non-GET requests) and
+# says so in a header. The body check uses a marker only the interstitial
+# has: the WAF SDK's script names also appear on normal protected pages.
+_WAF_CHALLENGE_STATUSES = frozenset({202, 405})
+_WAF_INTERSTITIAL_MARKER = "gokuProps"
+
+# Browser-side check that the current document is no longer a WAF challenge
+_WAF_CLEARED_JS = "marker => !document.documentElement.outerHTML.includes(marker)"
+
+# curl_cffi sessions wrap a curl handle and are not thread-safe
+_cffi_sessions = threading.local()
+
+
+def _get_cffi_session():
+    """Get this thread's curl_cffi session, or None if curl_cffi is missing"""
+    if cffi is None:
+        return None
+    session = getattr(_cffi_sessions, 'session', None)
+    if session is None:
+        session = _cffi_sessions.session = cffi.Session(impersonate=CFFI_IMPERSONATE)
+    return session
+
+
+class _PlaywrightPool:
+    """
+    One Playwright driver and Chromium browser, reused across requests.
+    
+    Launching Chromium dominates the cost of a single fetch, so the browser
+    is kept alive and each request gets its own (cheap) browser context.
+    Contexts start with the storage state (cookies, localStorage) saved
+    from the last page load that got past the WAF, so they skip the
+    challenge until BROWSER_STATE_TTL expires.
+    """
+    
+    def __init__(self):
+        self.pw = sync_playwright().start()
+        self.browser = self.pw.chromium.launch(headless=True)
+        self.storage_state = None
+        self.storage_saved_at = 0.0
+    
+    @contextmanager
+    def new_context(self, **kwargs):
+        """Yield a fresh browser context (with any saved cookies), closed on exit"""
+        fresh = time.monotonic() - self.storage_saved_at <= BROWSER_STATE_TTL
+        context = self.browser.new_context(
+            user_agent=BROWSER_USER_AGENT,
+            storage_state=self.storage_state if fresh else None,
+            **kwargs
+        )
+        context.route('**/*', _block_static_assets)
+        try:
+            yield context
+        finally:
+            context.close()
+    
+    def save_storage_state(self, context):
+        """Remember a context's cookies/localStorage for future contexts"""
+        try:
+            self.storage_state = context.storage_state()
+            self.storage_saved_at = time.monotonic()
+        except Exception:
+            pass
+    
+    def close(self):
+        try:
+            self.browser.close()
+            self.pw.stop()
+        except Exception:
+            pass
+
+
+def _block_static_assets(route):
+    """Route handler: abort images, fonts, media and CSS; let the rest through"""
+    if route.request.resource_type in _BLOCKED_RESOURCE_TYPES:
+        route.abort()
+    else:
+        route.continue_()
+
+
+class _BrowserThread:
+    """
+    A long-lived thread that owns the shared browser.
+    
+    Playwright's sync API is bound to the thread that started it, so every
+    browser call from any thread (scrape/download workers, API requests)
+    is submitted here and runs on this one thread. The browser is launched
+    on first use and closed on this thread when it stops.
+    
+    This means browser work is serial: however many workers fall back to
+    Playwright, only one page or download is driven at a time. The cheap
+    HTTP paths (requests, curl_cffi) still run concurrently, and the
+    browser is only the fallback. Running several contexts in parallel
+    would need async_playwright on an event loop instead of this thread.
+    """
+    
+    def __init__(self):
+        self.pool = None
+        self._jobs = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="playwright", daemon=True)
+        self._thread.start()
+    
+    def _loop(self):
+        while (job := self._jobs.get()) is not None:
+            fn, args, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+        
+        if self.pool is not None:
+            self.pool.close()
+    
+    def get_pool(self) -> _PlaywrightPool:
+        """The browser pool, (re)launched if needed; only call on this thread"""
+        if self.pool is None or not self.pool.browser.is_connected():
+            if self.pool is not None:
+                self.pool.close()
+            self.pool = _PlaywrightPool()
+        return self.pool
+    
+    def run(self, fn, *args):
+        """Run fn(pool, *args) on the browser thread and return its result"""
+        if threading.current_thread() is self._thread:
+            return fn(self.get_pool(), *args)
+        
+        future = Future()
+        self._jobs.put((lambda *a: fn(self.get_pool(), *a), args, future))
+        return future.result()
+    
+    def stop(self, timeout: float = 30):
+        """Close the browser and end the thread"""
+        self._jobs.put(None)
+        self._thread.join(timeout)
+
+
+_browser = None
+_browser_lock = threading.Lock()
+
+
+def _in_browser(fn, *args):
+    """Run fn(pool, *args) on the shared browser thread, starting it on first use"""
+    global _browser
+    with _browser_lock:
+        if _browser is None:
+            _browser = _BrowserThread()
+            # atexit runs after non-daemon threads finish but while this
+            # daemon thread is still alive, so the browser closes cleanly
+            atexit.register(shutdown)
+        browser = _browser
+    return browser.run(fn, *args)
+
 
+def shutdown():
+    """Close the shared browser, if one was launched"""
+    global _browser
+    with _browser_lock:
+        browser, _browser = _browser, None
+    if browser is not None:
+        browser.stop()
 
-def get_page_with_playwright(url: str, wait_time: int = 5000) -> str:
+
+def get_page_with_playwright(url: str, wait_time: int = 1000) -> str | None:
     """
     Fetch a page using Playwright to bypass bot protection.
 
@@ -35,18 +245,25 @@ def get_page_with_playwright(url: str, wait_time: int = 5000) -> str:
         wait_time: Time to wait for page to load (ms)
 
     Returns:
-        Page HTML content
+        Page HTML content, or None if the page could not be loaded or the
+        WAF challenge was not solved
     """
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        context = browser.new_context(
-            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-        )
-        page = context.new_page()
+    try:
+        return _in_browser(_get_page, url, wait_time)
+    except PlaywrightError as e:
+        # e.g. Chromium failed to launch
+        print(f"  Browser error for {url}: {e}")
+        return None
 
-        try:
-            # Navigate and wait for network to be idle
-            page.goto(url, wait_until="networkidle", timeout=60000)
+
+def _get_page(pool: _PlaywrightPool, url: str, wait_time: int) -> str | None:
+    """Body of get_page_with_playwright; runs on the browser thread"""
+    try:
+        with pool.new_context() as context:
+            page = context.new_page()
+
+            # Static assets are blocked, so the DOM is all we need to wait for
+            page.goto(url, wait_until="domcontentloaded", timeout=60000)
 
             # Additional wait for any JavaScript challenges
             page.wait_for_timeout(wait_time)
@@ -54,24 +271,126 @@ def get_page_with_playwright(url: str, wait_time: int = 5000) -> str:
             # Get the page content
             content = page.content()
 
-        except PlaywrightTimeout:
-            print(f"  Timeout loading {url}")
-            content = ""
-        finally:
-            browser.close()
+            # A WAF challenge reloads the page once solved; wait until the
+            # interstitial is gone from the loaded document
+            if _WAF_INTERSTITIAL_MARKER in content:
+                page.wait_for_function(_WAF_CLEARED_JS, arg=_WAF_INTERSTITIAL_MARKER, timeout=30000)
+                page.wait_for_load_state("domcontentloaded")
+                content = page.content()
+
+            if not content or _WAF_INTERSTITIAL_MARKER in content:
+                print(f"  WAF challenge not solved for {url}")
+                return None
+
+            # Past the WAF: keep the token for later contexts
+            pool.save_storage_state(context)
+            return content
+
+    except PlaywrightTimeout:
+        print(f"  Timeout loading {url}")
+    except PlaywrightError as e:
+        # e.g. the execution context is destroyed by the challenge redirect
+        print(f"  Error loading {url}: {e}")
+    return None
+
+
+def _html_cache_path(url: str) -> str:
+    return os.path.join(HTML_CACHE_DIR, f"{hashlib.md5(url.encode()).hexdigest()}.json")
+
+
+def _load_html_cache(url: str) -> dict | None:
+    """Load cached HTML and its validators (etag, last_modified) for a URL"""
+    try:
+        with open(_html_cache_path(url), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_html_cache(url: str, html: str, headers):
+    """Cache HTML if the server sent validators to revalidate it with later"""
+    etag = headers.get('ETag')
+    last_modified = headers.get('Last-Modified')
+    if not etag and not last_modified:
+        return
+
+    try:
+        os.makedirs(HTML_CACHE_DIR, exist_ok=True)
+        with open(_html_cache_path(url), 'w', encoding='utf-8') as f:
+            json.dump({'etag': etag, 'last_modified': last_modified, 'html': html}, f, ensure_ascii=False)
+    except OSError as e:
+        print(f"  Could not cache HTML for {url}: {e}")
+
+
+def _is_waf_challenge(status_code: int, headers, html: str) -> bool:
+    """Whether an HTTP response is an AWS WAF challenge rather than the page"""
+    return (
+        status_code in _WAF_CHALLENGE_STATUSES
+        or headers.get('x-amzn-waf-action', '').lower() == 'challenge'
+        or _WAF_INTERSTITIAL_MARKER in html
+    )
+
+
+def fetch_html(url: str, use_cache: bool = False) -> str | None:
+    """
+    Fetch a page's HTML, escalating to Playwright only when needed.
+    
+    Tries a plain HTTP client first (curl_cffi with a Chrome TLS fingerprint
+    if installed, else requests), and falls back to Playwright on errors,
+    empty pages or WAF challenges.
+    
+    Args:
+        url: URL to fetch
+        use_cache: Revalidate a cached copy with If-None-Match /
+            If-Modified-Since and reuse it on 304 Not Modified
+    """
+    cached = _load_html_cache(url) if use_cache else None
+    headers = {}
+    if cached:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+
+    session = _get_cffi_session()
+    if session is None:
+        # curl_cffi sets its own browser headers; plain requests needs ours
+        session = _SESSION
+        headers = {**REQUEST_HEADERS, **headers}
 
-    return content
+    try:
+        response = session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        if response.status_code == 304 and cached:
+            return cached['html']
+
+        html = response.text
+    except Exception as e:
+        print(f"  HTTP fetch failed for {url} ({e}); using browser")
+        return get_page_with_playwright(url)
+
+    if response.status_code < 400 and html and not _is_waf_challenge(response.status_code, response.headers, html):
+        if use_cache:
+            _save_html_cache(url, html, response.headers)
+        return html
+
+    return get_page_with_playwright(url)
 
 
 def get_document_hash(url: str) -> str:
-    """Generate a unique hash for a document URL"""
+    """
+    Generate a unique hash for a document URL.
+    
+    The hash prefixes downloaded filenames, which in turn feed the chunk
+    IDs in the vector store, so it must stay stable: changing the
+    algorithm would re-download and re-index every document.
+    """
     return hashlib.md5(url.encode()).hexdigest()[:12]
 
 
 def sanitize_filename(filename: str) -> str:
     """Clean filename for filesystem compatibility"""
     # Remove invalid characters
-    filename = re.sub(r'[<>:"/\\|?*]', '', filename)
+    filename = _INVALID_FILENAME_CHARS.sub('', filename)
     # Replace spaces with underscores
     filename = filename.replace(' ', '_')
     # Limit length
@@ -87,17 +406,20 @@ def scrape_policy_page(url: str) -> list[dict]:
     """
     print(f"Scraping: {url}")
 
-    # Use Playwright to fetch the page (bypasses WAF)
-    content = get_page_with_playwright(url)
+    # Fetch the page (revalidates the cached copy; escalates to Playwright
+    # if the WAF blocks us)
+    content = fetch_html(url, use_cache=True)
 
     if not content:
         print(f"Error fetching {url}: No content returned")
         return []
 
-    soup = BeautifulSoup(content, 'html.parser')
+    soup = BeautifulSoup(content, 'lxml', parse_only=_LINK_STRAINER)
     documents = []
+    seen_urls = set()
     
-    # Strategy 1: Find direct PDF links
+    # Single pass over links, deduplicating by URL as we go. PDF links in
+    # document tables are <a> tags too, so they are covered here.
     for link in soup.find_all('a', href=True):
         href = link['href']
         
@@ -105,55 +427,32 @@ def scrape_policy_page(url: str) -> list[dict]:
         is_pdf = href.lower().endswith('.pdf')
         is_policy = '/policy-document/' in href.lower() or '/pd/' in href.lower()
         
-        if is_pdf or is_policy:
-            full_url = urljoin(url, href)
-            
-            # Extract title from link text or filename
-            title = link.get_text(strip=True)
-            if not title or len(title) < 3:
-                title = os.path.basename(urlparse(href).path)
-                title = title.replace('.pdf', '').replace('-', ' ').replace('_', ' ')
-            
-            documents.append({
-                'url': full_url,
-                'title': title,
-                'source_page': url,
-                'type': 'pdf' if is_pdf else 'policy_page',
-                'scraped_at': datetime.now().isoformat()
-            })
-    
-    # Strategy 2: Look for document tables (common in BNM)
-    for table in soup.find_all('table'):
-        for row in table.find_all('tr'):
-            links = row.find_all('a', href=True)
-            for link in links:
-                href = link['href']
-                if href.lower().endswith('.pdf'):
-                    full_url = urljoin(url, href)
-                    
-                    # Try to get title from row text
-                    title = row.get_text(strip=True)[:100]
-                    if not title:
-                        title = link.get_text(strip=True)
-                    
-                    documents.append({
-                        'url': full_url,
-                        'title': title,
-                        'source_page': url,
-                        'type': 'pdf',
-                        'scraped_at': datetime.now().isoformat()
-                    })
-    
-    # Deduplicate by URL
-    seen_urls = set()
-    unique_docs = []
-    for doc in documents:
-        if doc['url'] not in seen_urls:
-            seen_urls.add(doc['url'])
-            unique_docs.append(doc)
+        if not (is_pdf or is_policy):
+            continue
+        
+        full_url = urljoin(url, href)
+        if full_url in seen_urls:
+            continue
+        seen_urls.add(full_url)
+        
+        # Extract title from link text or filename
+        title = link.get_text(strip=True)
+        if not title or len(title) < 3:
+            # Must match the old replace chain exactly: the title feeds
+            # the download filename and therefore the chunk IDs
+            title = os.path.basename(urlparse(href).path)
+            title = title.replace('.pdf', '').translate(_SEPARATORS_TO_SPACES)
+        
+        documents.append({
+            'url': full_url,
+            'title': title,
+            'source_page': url,
+            'type': 'pdf' if is_pdf else 'policy_page',
+            'scraped_at': datetime.now().isoformat()
+        })
     
-    print(f"  Found {len(unique_docs)} documents")
-    return unique_docs
+    print(f"  Found {len(documents)} documents")
+    return documents
 
 
 def scrape_policy_document_page(url: str) -> dict | None:
@@ -161,13 +460,13 @@ def scrape_policy_document_page(url: str) -> dict | None:
     For non-PDF policy pages, try to find the actual PDF download link.
     Uses Playwright to bypass AWS WAF bot protection.
     """
-    content = get_page_with_playwright(url)
+    content = fetch_html(url)
 
     if not content:
         print(f"Error fetching policy page {url}: No content returned")
         return None
 
-    soup = BeautifulSoup(content, 'html.parser')
+    soup = BeautifulSoup(content, 'lxml', parse_only=_POLICY_PAGE_STRAINER)
     
     # Look for PDF download button/link
     for link in soup.find_all('a', href=True):
@@ -185,9 +484,112 @@ def scrape_policy_document_page(url: str) -> dict | None:
     return None
 
 
+def _expected_length(headers) -> int | None:
+    """Body size promised by Content-Length, if it can be checked on disk"""
+    # Compressed bodies are decoded while streaming, so sizes won't match
+    if headers.get('Content-Encoding'):
+        return None
+    try:
+        return int(headers['Content-Length'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _finalize_download(tmp_path: str, filepath: str, expected_length: int = None) -> bool:
+    """
+    Atomically move a completed download into place.
+    
+    The partial file is discarded if it is empty or shorter/longer than
+    the server's Content-Length, so an interrupted download is never
+    mistaken for a complete one.
+    """
+    try:
+        size = os.path.getsize(tmp_path)
+    except OSError:
+        return False
+
+    if size > 0 and (expected_length is None or size == expected_length):
+        os.replace(tmp_path, filepath)
+        return True
+
+    os.remove(tmp_path)
+    return False
+
+
+def _head_validators(url: str) -> dict | None:
+    """Content-Length and Last-Modified of a PDF from a HEAD request, or None if unavailable"""
+    try:
+        response = _SESSION.head(url, headers=REQUEST_HEADERS, timeout=REQUEST_TIMEOUT,
+                                 allow_redirects=True)
+    except requests.RequestException:
+        return None
+
+    # A WAF challenge answers with HTML (often 202/403), which tells us nothing
+    if response.status_code != 200 or 'html' in response.headers.get('Content-Type', ''):
+        return None
+
+    return {
+        'content_length': _expected_length(response.headers),
+        'last_modified': response.headers.get('Last-Modified')
+    }
+
+
+def _is_current(filepath: str, remote: dict | None, stored: dict) -> bool:
+    """
+    Whether a downloaded PDF still matches the server's copy.
+    
+    Compares the local size with the remote Content-Length and the
+    Last-Modified recorded at download time with the remote one. Anything
+    the server doesn't report (or a failed HEAD) counts as a match, so
+    existing files are kept when in doubt.
+    """
+    if remote is None:
+        return True
+
+    if remote['content_length'] is not None and remote['content_length'] != os.path.getsize(filepath):
+        return False
+
+    stored_lm = stored.get('last_modified')
+    return not (stored_lm and remote['last_modified'] and remote['last_modified'] != stored_lm)
+
+
+def _record_validators(doc: dict, filepath: str, last_modified: str | None):
+    """Store size and Last-Modified on the document so the index persists them"""
+    doc['content_length'] = os.path.getsize(filepath)
+    if last_modified:
+        doc['last_modified'] = last_modified
+
+
+# Document index entries from the last run, reloaded when the file changes
+_index_cache = {'mtime': None, 'by_url': {}}
+_index_lock = threading.Lock()
+
+
+def _indexed_document(url: str) -> dict:
+    """The saved document index entry for a URL, or {} if there is none"""
+    try:
+        mtime = os.path.getmtime(DOCUMENT_INDEX_PATH)
+    except OSError:
+        return {}
+
+    with _index_lock:
+        if _index_cache['mtime'] != mtime:
+            _index_cache['by_url'] = {d['url']: d for d in load_document_index()}
+            _index_cache['mtime'] = mtime
+        return _index_cache['by_url'].get(url, {})
+
+
 def download_pdf(doc: dict) -> str | None:
     """
-    Download a PDF document using Playwright to bypass WAF.
+    Download a PDF document, via curl_cffi if possible, else Playwright.
+
+    An existing copy is kept unless a HEAD request shows the server's
+    Content-Length or Last-Modified has changed (no HEAD is sent for new
+    documents). Downloads are written to '<file>.part' and renamed into
+    place only once complete. The size and the Last-Modified from the
+    download response are stored on the doc for the document index.
+    Concurrent callers must not pass two docs with the same URL (they can
+    share a '.part' file); download_document's claimed set ensures this.
 
     Args:
         doc: Document metadata dict with 'url' and 'title' keys
@@ -201,39 +603,66 @@ def download_pdf(doc: dict) -> str | None:
     doc_hash = get_document_hash(url)
     filename = f"{doc_hash}_{sanitize_filename(doc['title'])}.pdf"
     filepath = os.path.join(DOCUMENTS_DIR, filename)
+    tmp_path = filepath + ".part"
+
+    have_copy = os.path.exists(filepath) and os.path.getsize(filepath) > 0
+
+    # Skip if already downloaded, not empty and unchanged on the server
+    # (a HEAD request is cheap and tells us whether the copy is current)
+    if have_copy:
+        remote = _head_validators(url)
+        stored = _indexed_document(url)
+        if _is_current(filepath, remote, stored):
+            print(f"  Already exists: {filename[:50]}...")
+            _record_validators(doc, filepath, (remote or {}).get('last_modified') or stored.get('last_modified'))
+            return filepath
+        print(f"  Changed on server: {filename[:50]}...")
+    elif os.path.exists(filepath):
+        # Remove empty file
+        os.remove(filepath)
 
-    # Skip if already downloaded and not empty
-    if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
-        print(f"  Already exists: {filename[:50]}...")
-        return filepath
+    # Remove partial downloads left behind by an interrupted run
+    if os.path.exists(tmp_path) and time.time() - os.path.getmtime(tmp_path) > PART_FILE_MAX_AGE:
+        os.remove(tmp_path)
 
-    # Remove empty file if it exists
-    if os.path.exists(filepath):
-        os.remove(filepath)
+    # The old copy is only replaced once a new one has fully downloaded
+    headers = _fetch_pdf(doc, filepath)
+    if headers is None:
+        if not have_copy:
+            return None
+        print(f"  Re-download failed, keeping existing copy: {filename[:50]}...")
+        # Keep the old validators so the next run tries again
+        _record_validators(doc, filepath, stored.get('last_modified'))
+    else:
+        _record_validators(doc, filepath, headers.get('Last-Modified'))
 
-    try:
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            context = browser.new_context(
-                user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                accept_downloads=True
-            )
-            page = context.new_page()
+    return filepath
+
+
+def _fetch_pdf(doc: dict, filepath: str) -> dict | None:
+    """
+    Download a PDF to filepath, trying curl_cffi, Playwright, then requests.
+    
+    Returns:
+        The response headers (empty if unknown) on success, None otherwise
+    """
+    url = doc['url']
+    filename = os.path.basename(filepath)
+    tmp_path = filepath + ".part"
 
-            # Set up download handling
-            with page.expect_download(timeout=60000) as download_info:
-                # Navigate to PDF URL - this triggers the download
-                page.goto(url, timeout=60000)
+    # Fast path: no browser needed if the WAF accepts curl_cffi
+    headers = download_pdf_cffi(url, filepath)
+    if headers is not None:
+        print(f"  Downloaded: {filename[:50]}...")
+        return headers
 
-            download = download_info.value
-            # Save the download to our filepath
-            download.save_as(filepath)
-            browser.close()
+    try:
+        headers = _in_browser(_download_with_playwright, url, tmp_path)
 
         # Verify file was downloaded and is not empty
-        if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
+        if _finalize_download(tmp_path, filepath):
             print(f"  Downloaded: {filename[:50]}...")
-            return filepath
+            return headers
         else:
             print(f"  Empty download: {url}")
             return None
@@ -244,11 +673,96 @@ def download_pdf(doc: dict) -> str | None:
         return download_pdf_fallback(doc, filepath)
 
 
-def download_pdf_fallback(doc: dict, filepath: str) -> str | None:
-    """Fallback download using requests for PDFs that don't need WAF bypass."""
+def _download_with_playwright(pool: _PlaywrightPool, url: str, tmp_path: str) -> dict:
+    """
+    Download a PDF to tmp_path in a browser context; runs on the browser thread.
+    
+    Returns:
+        Validator headers from the response ({} for navigation downloads)
+    """
+    with pool.new_context(accept_downloads=True) as context:
+        # Try a plain request through the context first (shares its
+        # cookies, no page render or JS); navigate only if it's blocked
+        headers = _download_via_request(context, url, tmp_path)
+        if headers is not None:
+            return headers
+
+        page = context.new_page()
+
+        # Set up download handling
+        with page.expect_download(timeout=60000) as download_info:
+            # Navigate to PDF URL - this triggers the download
+            page.goto(url, timeout=60000)
+
+        download = download_info.value
+        # Save the download, then move it into place
+        download.save_as(tmp_path)
+        return {}
+
+
+def _download_via_request(context, url: str, tmp_path: str) -> dict | None:
+    """Fetch a PDF with the context's APIRequestContext; None if not a PDF"""
+    try:
+        response = context.request.get(url, timeout=60000)
+        if not response.ok:
+            return None
+
+        body = response.body()
+        if not body.startswith(b'%PDF-'):
+            return None
+
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        # Playwright lower-cases header names
+        return {'Last-Modified': response.headers.get('last-modified')}
+    except Exception:
+        return None
+
+
+def download_pdf_cffi(url: str, filepath: str) -> dict | None:
+    """Download a PDF with curl_cffi; returns the response headers, or None if blocked or not a PDF"""
+    session = _get_cffi_session()
+    if session is None:
+        return None
+
+    tmp_path = filepath + ".part"
+    try:
+        response = session.get(url, timeout=REQUEST_TIMEOUT, stream=True)
+        if response.status_code >= 400:
+            response.close()
+            return None
+
+        with open(tmp_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=65536):
+                f.write(chunk)
+        response.close()
+
+        # A WAF challenge comes back as HTML, not a PDF
+        with open(tmp_path, 'rb') as f:
+            is_pdf = f.read(5) == b'%PDF-'
+        if is_pdf:
+            if _finalize_download(tmp_path, filepath, _expected_length(response.headers)):
+                return response.headers
+            return None
+    except Exception as e:
+        print(f"  curl_cffi download failed for {url}: {e}")
+
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    return None
+
+
+def download_pdf_fallback(doc: dict, filepath: str) -> dict | None:
+    """
+    Fallback download using requests for PDFs that don't need WAF bypass.
+    
+    Returns:
+        The response headers on success, None otherwise
+    """
     url = doc['url']
+    tmp_path = filepath + ".part"
     try:
-        response = requests.get(
+        response = _SESSION.get(
             url,
             headers=REQUEST_HEADERS,
             timeout=REQUEST_TIMEOUT,
@@ -256,16 +770,18 @@ def download_pdf_fallback(doc: dict, filepath: str) -> str | None:
         )
         response.raise_for_status()
 
-        with open(filepath, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
+        with open(tmp_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=65536):
                 f.write(chunk)
 
-        if os.path.getsize(filepath) > 0:
+        if _finalize_download(tmp_path, filepath, _expected_length(response.headers)):
             print(f"  Downloaded (fallback): {os.path.basename(filepath)[:50]}...")
-            return filepath
+            return response.headers
         return None
 
     except requests.RequestException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
         return None
 
 
@@ -277,20 +793,70 @@ def scrape_all_documents() -> list[dict]:
         List of document metadata dictionaries
     """
     all_documents = []
+    seen_urls = set()
     
-    for url in BNM_POLICY_URLS:
-        documents = scrape_policy_page(url)
-        all_documents.extend(documents)
+    # Pages are fetched concurrently over HTTP; browser fallbacks run one at
+    # a time on the shared browser thread (see _BrowserThread).
+    # Documents linked from several pages are kept once, in page order.
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_CONCURRENCY) as executor:
+        for documents in executor.map(scrape_policy_page, BNM_POLICY_URLS):
+            for doc in documents:
+                if doc['url'] not in seen_urls:
+                    seen_urls.add(doc['url'])
+                    all_documents.append(doc)
     
-    # Deduplicate across all pages
-    seen_urls = set()
-    unique_docs = []
-    for doc in all_documents:
-        if doc['url'] not in seen_urls:
-            seen_urls.add(doc['url'])
-            unique_docs.append(doc)
+    return all_documents
+
+
+# Guards the claimed-URL sets shared by concurrent download_document calls
+_claim_lock = threading.Lock()
+
+
+def claim_url(url: str, claimed: set) -> bool:
+    """Add url to a set shared between threads; False if it was already there"""
+    with _claim_lock:
+        if url in claimed:
+            return False
+        claimed.add(url)
+        return True
+
+
+def download_document(doc: dict, claimed: set = None) -> dict | None:
+    """
+    Resolve policy pages to their PDF and download it.
+    
+    Args:
+        doc: Document metadata from scrape_all_documents
+        claimed: PDF URLs already taken by other documents of the same run.
+            A policy page can resolve to a PDF that is also linked directly;
+            only the first document to claim a URL downloads it, so each PDF
+            has one local copy (and one set of chunks in the index).
+    
+    Returns:
+        The document with 'local_path' added, or None on failure or if
+        another document already claimed its PDF
+    """
+    # Handle policy pages that need further scraping
+    if doc['type'] == 'policy_page':
+        resolved = scrape_policy_document_page(doc['url'])
+        if not resolved:
+            return None
+        doc.update(resolved)
+    
+    if claimed is not None and not claim_url(doc['url'], claimed):
+        return None
     
-    return unique_docs
+    # Download PDF
+    local_path = download_pdf(doc)
+    if not local_path:
+        # Let another document linking the same PDF try it
+        if claimed is not None:
+            with _claim_lock:
+                claimed.discard(doc['url'])
+        return None
+    
+    doc['local_path'] = local_path
+    return doc
 
 
 def download_all_documents(documents: list[dict]) -> list[dict]:
@@ -300,34 +866,28 @@ def download_all_documents(documents: list[dict]) -> list[dict]:
     Returns:
         List of documents with 'local_path' added
     """
-    downloaded = []
-    
     print(f"\nDownloading {len(documents)} documents...")
-    for doc in tqdm(documents, desc="Downloading"):
-        # Handle policy pages that need further scraping
-        if doc['type'] == 'policy_page':
-            resolved = scrape_policy_document_page(doc['url'])
-            if resolved:
-                doc.update(resolved)
-            else:
-                continue
-        
-        # Download PDF
-        local_path = download_pdf(doc)
-        if local_path:
-            doc['local_path'] = local_path
-            downloaded.append(doc)
     
-    return downloaded
+    # Downloads are network-bound, so run them concurrently
+    claimed = set()
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_CONCURRENCY) as executor:
+        results = list(tqdm(
+            executor.map(lambda doc: download_document(doc, claimed), documents),
+            total=len(documents),
+            desc="Downloading"
+        ))
+    
+    return [doc for doc in results if doc]
 
 
 def save_document_index(documents: list[dict], filepath: str = None):
     """Save document metadata index to JSON"""
     if filepath is None:
-        filepath = os.path.join(DOCUMENTS_DIR, "document_index.json")
+        filepath = DOCUMENT_INDEX_PATH
     
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(documents, f, indent=2, ensure_ascii=False)
+    # orjson serializes straight to UTF-8 bytes
+    with open(filepath, 'wb') as f:
+        f.write(orjson.dumps(documents, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
     
     print(f"Saved document index to {filepath}")
 
@@ -335,13 +895,13 @@ def save_document_index(documents: list[dict], filepath: str = None):
 def load_document_index(filepath: str = None) -> list[dict]:
     """Load document metadata index from JSON"""
     if filepath is None:
-        filepath = os.path.join(DOCUMENTS_DIR, "document_index.json")
+        filepath = DOCUMENT_INDEX_PATH
     
     if not os.path.exists(filepath):
         return []
     
-    with open(filepath, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    with open(filepath, 'rb') as f:
+        return orjson.loads(f.read())
 
 
 if __name__ == "__main__":
@@ -3,6 +3,10 @@ Vector Store Module
 Handles Chroma DB operations for document storage and retrieval
 """
 import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import requests
 import chromadb
 from chromadb.utils import embedding_functions
 from tqdm import tqdm
@@ -12,13 +16,19 @@ from config import (
     COLLECTION_NAME,
     EMBEDDING_TYPE,
     EMBEDDING_MODEL,
+    EMBED_BATCH_SIZE,
     RETRIEVAL_TOP_K,
+    HNSW_SEARCH_EF,
     OLLAMA_BASE_URL
 )
 
+# Bumped whenever the collection changes, so cached answers can be invalidated
+INDEX_VERSION_PATH = os.path.join(CHROMA_DB_PATH, "index_version")
 
+
+@lru_cache(maxsize=1)
 def get_embedding_function():
-    """Get the configured embedding function"""
+    """Get the configured embedding function (model loaded once per process)"""
     
     if EMBEDDING_TYPE == "ollama":
         return embedding_functions.OllamaEmbeddingFunction(
@@ -27,35 +37,212 @@ def get_embedding_function():
         )
     else:
         # Default: Sentence Transformers (runs locally, no API needed)
-        return embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name=EMBEDDING_MODEL
+        device = _embedding_device()
+        embedding_fn = embedding_functions.SentenceTransformerEmbeddingFunction(
+            model_name=EMBEDDING_MODEL,
+            device=device,
+            normalize_embeddings=True
         )
+        
+        # FP16 halves memory traffic on GPU (it is slower on CPU)
+        model = getattr(embedding_fn, '_model', None)
+        if device == "cuda" and model is not None:
+            model.half()
+        
+        return embedding_fn
+
 
+def _embedding_device() -> str:
+    """Pick the device for the local embedding model"""
+    try:
+        import torch
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    except ImportError:
+        return "cpu"
 
+
+@lru_cache(maxsize=1)
 def get_chroma_client():
-    """Get persistent Chroma client"""
+    """Get persistent Chroma client (shared for the life of the process)"""
     return chromadb.PersistentClient(path=CHROMA_DB_PATH)
 
 
 def get_collection():
     """Get or create the document collection"""
+    return _get_collection(get_index_version())
+
+
+@lru_cache(maxsize=1)
+def _get_collection(index_version: int):
+    """
+    Cached collection handle for a given index version.
+    
+    Keying on the version means a collection that was cleared and
+    recreated (possibly by another process, e.g. ingest.py --clear) is
+    looked up again instead of reusing a stale handle.
+    """
     client = get_chroma_client()
     embedding_fn = get_embedding_function()
     
     return client.get_or_create_collection(
         name=COLLECTION_NAME,
         embedding_function=embedding_fn,
-        metadata={"hnsw:space": "cosine"}  # Use cosine similarity
+        metadata={
+            "hnsw:space": "cosine",  # Use cosine similarity
+            "hnsw:search_ef": HNSW_SEARCH_EF  # Only applied when the collection is created
+        }
+    )
+
+
+def get_index_version() -> int:
+    """Get the current index version (0 if the index was never modified)"""
+    try:
+        with open(INDEX_VERSION_PATH, 'r') as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def bump_index_version() -> int:
+    """Mark the index as changed and return the new version"""
+    version = get_index_version() + 1
+    os.makedirs(CHROMA_DB_PATH, exist_ok=True)
+    with open(INDEX_VERSION_PATH, 'w') as f:
+        f.write(str(version))
+    return version
+
+
+def embed_query(text: str) -> list[float]:
+    """Embed a single query with the configured embedding function"""
+    return embed_queries([text])[0]
+
+
+def embed_queries(texts: list[str]) -> list[list[float]]:
+    """Embed several queries in one call to the configured embedding function"""
+    return [
+        emb.tolist() if hasattr(emb, 'tolist') else list(emb)
+        for emb in get_embedding_function()(texts)
+    ]
+
+
+def _embed_batch_ollama(texts: list[str]) -> list[list[float]]:
+    """Embed texts in one request to Ollama's batch /api/embed endpoint"""
+    response = requests.post(
+        f"{OLLAMA_BASE_URL}/api/embed",
+        json={"model": EMBEDDING_MODEL, "input": texts},
+        timeout=300
     )
+    
+    # Older Ollama versions only have the single-text endpoint (404 on /api/embed)
+    embeddings = None
+    if response.status_code != 404:
+        response.raise_for_status()
+        embeddings = response.json().get("embeddings")
+    
+    if not embeddings:
+        embeddings = []
+        for text in texts:
+            r = requests.post(
+                f"{OLLAMA_BASE_URL}/api/embeddings",
+                json={"model": EMBEDDING_MODEL, "prompt": text},
+                timeout=300
+            )
+            r.raise_for_status()
+            embeddings.append(r.json()["embedding"])
+    
+    return embeddings
 
 
-def add_documents(chunks: list[dict], batch_size: int = 100) -> int:
+def content_hash(text: str) -> str:
+    """Short digest identifying chunk text, used to reuse embeddings"""
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def _embed_texts(texts: list[str], batch_size: int = EMBED_BATCH_SIZE) -> list[list[float]]:
+    """
+    Embed document texts with the configured embedding backend.
+    
+    Texts are sorted longest-first and embedded in micro-batches, so each
+    batch holds similarly sized inputs and wastes little on padding;
+    results are returned in the original order.
+    """
+    if EMBEDDING_TYPE == "ollama":
+        embed_batch = _embed_batch_ollama
+    else:
+        embedding_fn = get_embedding_function()
+        model = getattr(embedding_fn, '_model', None)
+        
+        if model is not None:
+            # Call the model directly to control its internal batch size
+            embed_batch = lambda batch: model.encode(
+                batch,
+                batch_size=batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False
+            ).astype('float32').tolist()
+        else:
+            embed_batch = lambda batch: [
+                emb.tolist() if hasattr(emb, 'tolist') else list(emb)
+                for emb in embedding_fn(batch)
+            ]
+    
+    order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+    embeddings = [None] * len(texts)
+    
+    for start in range(0, len(order), batch_size):
+        batch_idx = order[start:start + batch_size]
+        batch_embeddings = embed_batch([texts[i] for i in batch_idx])
+        
+        for i, emb in zip(batch_idx, batch_embeddings):
+            embeddings[i] = emb
+    
+    return embeddings
+
+
+def _get_embeddings_by_hash(collection, hashes: list[str], batch_size: int = 500) -> dict[str, list[float]]:
+    """Fetch stored embeddings for content hashes already in the collection"""
+    known = {}
+    
+    for i in range(0, len(hashes), batch_size):
+        results = collection.get(
+            where={"content_hash": {"$in": hashes[i:i + batch_size]}},
+            include=['embeddings', 'metadatas']
+        )
+        for emb, meta in zip(results['embeddings'], results['metadatas']):
+            if meta['content_hash'] not in known:
+                known[meta['content_hash']] = emb.tolist() if hasattr(emb, 'tolist') else list(emb)
+    
+    return known
+
+
+def _get_indexed_chunks(collection, source_urls: list[str]) -> dict[str, dict]:
+    """Return the metadata of the chunks already indexed for the given sources, by ID"""
+    result = collection.get(where={"source_url": {"$in": source_urls}}, include=['metadatas'])
+    return dict(zip(result['ids'], result['metadatas']))
+
+
+def _max_batch_size() -> int | None:
+    """Largest batch Chroma accepts in one call, if the client reports it"""
+    client = get_chroma_client()
+    # get_max_batch_size() is newer; 0.4.x clients only have the property
+    if hasattr(client, 'get_max_batch_size'):
+        return client.get_max_batch_size()
+    return getattr(client, 'max_batch_size', None)
+
+
+# Maps path separators in chunk IDs to underscores
+_SLASH_TRANS = str.maketrans({'/': '_', '\\': '_'})
+
+
+def add_documents(chunks: list[dict], batch_size: int = 5000) -> int:
     """
     Add document chunks to the vector store.
     
     Args:
         chunks: List of chunk dicts with 'content' and 'metadata' keys
-        batch_size: Number of chunks to add at once
+        batch_size: Max chunks per collection.add call (each call is one
+            transaction; capped at Chroma's own max batch size)
         
     Returns:
         Number of chunks added
@@ -66,22 +253,33 @@ def add_documents(chunks: list[dict], batch_size: int = 100) -> int:
     
     collection = get_collection()
     
-    # Get existing IDs to avoid duplicates
-    existing_ids = set(collection.get()['ids'])
+    # Create unique IDs based on source and chunk index
+    chunk_ids = [
+        f"{m['pdf_path']}_{m['page']}_{m['chunk_index']}".translate(_SLASH_TRANS)
+        for m in (chunk['metadata'] for chunk in chunks)
+    ]
+    
+    # Look up only these documents' chunks (not the whole collection)
+    versions = {m['source_url']: m.get('source_version') for m in (chunk['metadata'] for chunk in chunks)}
+    indexed = _get_indexed_chunks(collection, list(versions))
+    
+    # A new copy of a PDF reuses the old copy's chunk IDs, so chunks from
+    # another copy are deleted first instead of being treated as duplicates.
+    # This only compares against what's stored in the index, so it also
+    # catches PDFs replaced by a run that stopped before indexing them.
+    stale = {m['source_url'] for m in indexed.values() if m.get('source_version') != versions[m['source_url']]}
+    for source_url in stale:
+        print(f"Replacing chunks of an older copy of {source_url}")
+        delete_by_source(source_url)
+    
+    existing_ids = {chunk_id for chunk_id, m in indexed.items() if m['source_url'] not in stale}
     
     # Prepare data
-    new_chunks = []
-    for i, chunk in enumerate(chunks):
-        # Create unique ID based on source and chunk index
-        chunk_id = f"{chunk['metadata']['pdf_path']}_{chunk['metadata']['page']}_{chunk['metadata']['chunk_index']}"
-        chunk_id = chunk_id.replace('/', '_').replace('\\', '_')
-        
-        if chunk_id not in existing_ids:
-            new_chunks.append({
-                'id': chunk_id,
-                'content': chunk['content'],
-                'metadata': chunk['metadata']
-            })
+    new_chunks = [
+        {'id': chunk_id, 'content': chunk['content'], 'metadata': chunk['metadata']}
+        for chunk_id, chunk in zip(chunk_ids, chunks)
+        if chunk_id not in existing_ids
+    ]
     
     if not new_chunks:
         print("All chunks already exist in the database")
@@ -89,20 +287,64 @@ def add_documents(chunks: list[dict], batch_size: int = 100) -> int:
     
     print(f"Adding {len(new_chunks)} new chunks...")
     
-    # Add in batches
-    for i in tqdm(range(0, len(new_chunks), batch_size), desc="Indexing"):
-        batch = new_chunks[i:i + batch_size]
-        
-        collection.add(
-            ids=[c['id'] for c in batch],
-            documents=[c['content'] for c in batch],
-            metadatas=[c['metadata'] for c in batch]
-        )
+    ids = [c['id'] for c in new_chunks]
+    documents = [c['content'] for c in new_chunks]
+    
+    # Tag chunks with a content hash so repeated text (headers, footers,
+    # boilerplate shared across PDFs) reuses an existing embedding
+    hashes = [content_hash(doc) for doc in documents]
+    metadatas = [
+        {**c['metadata'], 'content_hash': chunk_hash}
+        for c, chunk_hash in zip(new_chunks, hashes)
+    ]
+    
+    known = _get_embeddings_by_hash(collection, list(set(hashes)))
+    
+    # Embed each distinct unseen text once
+    to_embed = {}
+    for chunk_hash, doc in zip(hashes, documents):
+        if chunk_hash not in known and chunk_hash not in to_embed:
+            to_embed[chunk_hash] = doc
+    
+    if len(to_embed) < len(new_chunks):
+        print(f"Reusing embeddings for {len(new_chunks) - len(to_embed)} duplicate chunks")
+    
+    # Insert in as few calls as possible; each call is a single transaction
+    max_batch = _max_batch_size()
+    if max_batch:
+        batch_size = min(batch_size, max_batch)
+    
+    # Embed the next batch while a writer thread inserts the previous one.
+    # Chroma serializes writes to a local store, so one writer is enough.
+    pending = None
+    try:
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            for i in tqdm(range(0, len(new_chunks), batch_size), desc="Indexing"):
+                batch_hashes = hashes[i:i + batch_size]
+                unseen = [h for h in dict.fromkeys(batch_hashes) if h not in known]
+                known.update(zip(unseen, _embed_texts([to_embed[h] for h in unseen])))
+                
+                if pending:
+                    pending.result()
+                pending = writer.submit(
+                    collection.add,
+                    ids=ids[i:i + batch_size],
+                    documents=documents[i:i + batch_size],
+                    metadatas=metadatas[i:i + batch_size],
+                    embeddings=[known[h] for h in batch_hashes]
+                )
+            pending.result()
+    finally:
+        # Earlier batches stay committed if a later one fails, so cached
+        # answers must be invalidated once anything may have been written
+        if pending is not None:
+            bump_index_version()
     
     return len(new_chunks)
 
 
-def search(query: str, n_results: int = None, filter_dict: dict = None) -> dict:
+def search(query: str, n_results: int = None, filter_dict: dict = None,
+           query_embedding: list[float] = None) -> dict:
     """
     Search the vector store.
     
@@ -110,6 +352,7 @@ def search(query: str, n_results: int = None, filter_dict: dict = None) -> dict:
         query: Search query text
         n_results: Number of results to return (default from config)
         filter_dict: Optional metadata filter
+        query_embedding: Precomputed embedding of the query, if available
         
     Returns:
         Dict with 'documents', 'metadatas', 'distances' keys
@@ -120,11 +363,15 @@ def search(query: str, n_results: int = None, filter_dict: dict = None) -> dict:
     collection = get_collection()
     
     query_params = {
-        'query_texts': [query],
         'n_results': n_results,
         'include': ['documents', 'metadatas', 'distances']
     }
     
+    if query_embedding is not None:
+        query_params['query_embeddings'] = [query_embedding]
+    else:
+        query_params['query_texts'] = [query]
+    
     if filter_dict:
         query_params['where'] = filter_dict
     
@@ -133,6 +380,33 @@ def search(query: str, n_results: int = None, filter_dict: dict = None) -> dict:
     return results
 
 
+def search_batch(queries: list[str], n_results: int = None,
+                 query_embeddings: list[list[float]] = None) -> dict:
+    """
+    Search the vector store for several queries in one call.
+    
+    The queries are embedded together (unless query_embeddings are given)
+    and looked up in a single Chroma query; result lists are indexed by
+    query position.
+    
+    Returns:
+        Dict with 'documents', 'metadatas', 'distances' keys
+    """
+    if n_results is None:
+        n_results = RETRIEVAL_TOP_K
+    
+    collection = get_collection()
+    
+    if query_embeddings is None:
+        query_embeddings = embed_queries(queries)
+    
+    return collection.query(
+        query_embeddings=query_embeddings,
+        n_results=n_results,
+        include=['documents', 'metadatas', 'distances']
+    )
+
+
 def get_stats() -> dict:
     """Get collection statistics"""
     collection = get_collection()
@@ -159,20 +433,19 @@ def delete_by_source(source_url: str) -> int:
         Number of chunks deleted
     """
     collection = get_collection()
+    where = {"source_url": source_url}
     
-    # Find chunks with this source
-    results = collection.get(
-        where={"source_url": source_url},
-        include=['metadatas']
-    )
+    # Count matching chunks without pulling documents/metadatas
+    count = len(collection.get(where=where, include=[])['ids'])
     
-    if not results['ids']:
+    if not count:
         return 0
     
-    # Delete them
-    collection.delete(ids=results['ids'])
+    # Delete them by filter
+    collection.delete(where=where)
+    bump_index_version()
     
-    return len(results['ids'])
+    return count
 
 
 def clear_collection():
@@ -185,6 +458,8 @@ def clear_collection():
     except ValueError:
         print(f"Collection {COLLECTION_NAME} does not exist")
     
+    bump_index_version()
+    
     # Recreate empty collection
     get_collection()
     print(f"Created fresh collection: {COLLECTION_NAME}")